@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+'''
+    Stand-in for script.module.metadatautils with a synthetic library.
+    The number of items, the latency of every json call and the latency per returned item
+    can be configured to simulate small and big libraries on slow and fast devices.
+'''
+
+import random
+import time
+import urllib
+
+LIBRARY = {
+    "size": 1000,  # number of items of every media type / directory
+    "latency": 0.0,  # seconds per json call
+    "item_latency": 0.0,  # seconds per returned item
+    "new_items": 10,  # number of items returned by the dateadded filter of an incremental sync
+    "pictures": "",  # path of the pictures source
+    "favourites": 0,  # number of favourites for the smart shortcuts
+    "images": [],  # local image files used as art, image:// urls are used when empty
+    "art_url": ""  # url template (kind, index) of the art, e.g. a local http server
+}
+STATS = {"calls": 0, "items": 0}
+
+ID_FIELDS = {"VideoLibrary.GetMovies": "movieid", "VideoLibrary.GetMovieDetails": "movieid",
+             "VideoLibrary.GetTVShows": "tvshowid", "VideoLibrary.GetTVShowDetails": "tvshowid"}
+
+
+def get_art_url(kind, index):
+    '''returns the url of the given art of an item'''
+    if LIBRARY["images"]:
+        return LIBRARY["images"][index % len(LIBRARY["images"])]
+    if LIBRARY["art_url"]:
+        return LIBRARY["art_url"] % (kind, index)
+    return "image://http%%3a%%2f%%2fimage.server%%2f%s%%2f%s.jpg/" % (kind, index)
+
+
+def get_item(index, id_field="id"):
+    '''returns the synthetic library item with the given index'''
+    return {
+        "label": "Item %s" % index,
+        "title": "Item %s" % index,
+        id_field: index + 1,
+        "file": "videodb://item/%s" % index,
+        "art": {"fanart": get_art_url("fanart", index), "poster": get_art_url("poster", index),
+                "landscape": get_art_url("landscape", index), "clearlogo": get_art_url("clearlogo", index),
+                "thumb": get_art_url("thumb", index)},
+        "fanart": get_art_url("fanart", index),
+        "thumbnail": get_art_url("thumb", index),
+        "playcount": index % 3 and 1 or 0,
+        "resume": {"position": 60 if index % 7 == 0 else 0, "total": 5400},
+        "episode": 20,
+        "watchedepisodes": index % 21,
+        "dateadded": "2020-%02d-%02d 12:00:00" % (index % 12 + 1, index % 28 + 1)
+    }
+
+
+def respond(items):
+    '''simulate the latency of the json api'''
+    STATS["calls"] += 1
+    STATS["items"] += len(items)
+    delay = LIBRARY["latency"] + LIBRARY["item_latency"] * len(items)
+    if delay:
+        time.sleep(delay)
+    return items
+
+
+class KodiDb(object):
+
+    def get_json(self, method, sort=None, filters=None, fields=None, limits=None, returntype=None,
+                 optparam=None, filtertype=None):
+        size = LIBRARY["size"]
+        if method == "Files.GetSources":
+            return respond([{"file": LIBRARY["pictures"], "label": "Pictures"}] if LIBRARY["pictures"] else [])
+        if method.endswith("Details"):
+            return respond([get_item(optparam[1] - 1, ID_FIELDS[method])])[0]
+        if returntype == "limits":
+            respond([])
+            return {"start": 0, "end": min(size, 1), "total": size}
+        if method in ID_FIELDS:
+            indexes = xrange(size)
+            if filters:
+                # dateadded filter of an incremental sync
+                indexes = xrange(max(0, size - LIBRARY["new_items"]), size)
+            return respond([get_item(index, ID_FIELDS[method]) for index in indexes])
+        start, end = limits or (0, size)
+        if sort and sort.get("method") == "random":
+            # directory listing in random order
+            indexes = random.sample(xrange(size), max(0, min(end, size) - start))
+        else:
+            # pages of the directory listing in a stable order
+            indexes = xrange(start, min(end, size))
+        return respond([get_item(index) for index in indexes])
+
+    def files(self, path):
+        return []
+
+    def favourites(self):
+        return respond([{"type": "window", "window": "Videos", "label": "Favourite %s" % index,
+                         "windowparameter": "plugin://plugin.video.fake/?node=%s" % index}
+                        for index in range(LIBRARY["favourites"])])
+
+
+class MetadataUtils(object):
+
+    def __init__(self):
+        self.kodidb = KodiDb()
+
+    @staticmethod
+    def get_clean_image(image):
+        '''same decoding as metadatautils, this is part of the measured work'''
+        if not image:
+            return ""
+        if image.startswith("image://"):
+            image = urllib.unquote(image[8:].encode("utf-8")).decode("utf-8")
+            if image.endswith("/"):
+                image = image[:-1]
+        return image
+
+    @staticmethod
+    def detect_plugin_content(content):
+        return "movies"
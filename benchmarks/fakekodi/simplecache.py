@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+
+'''Stand-in for the simplecache module: an in memory cache'''
+
+STORE = {}
+
+
+class SimpleCache(object):
+
+    def get(self, endpoint, checksum=""):
+        return STORE.get(endpoint)
+
+    def set(self, endpoint, data, checksum="", expiration=None):
+        STORE[endpoint] = data
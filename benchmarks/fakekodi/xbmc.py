@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+'''
+    Stand-in for the xbmc module of Kodi, only implements what the backgrounds service uses.
+    special:// paths are mapped to the directory in the BENCHMARK_ROOT environment variable.
+'''
+
+import os
+import time
+
+LOGDEBUG, LOGINFO, LOGNOTICE, LOGWARNING, LOGERROR = 0, 1, 2, 3, 4
+CONDITIONS = {}  # condition --> result, the library has content by default
+INFOLABELS = {}
+LOG = []
+
+
+def log(msg, level=LOGDEBUG):
+    '''keep the log in memory, printed when BENCHMARK_VERBOSE is set'''
+    LOG.append(msg)
+    if os.environ.get("BENCHMARK_VERBOSE"):
+        print(msg)
+
+
+def getCondVisibility(condition):
+    if condition in CONDITIONS:
+        return CONDITIONS[condition]
+    return condition.startswith("Library.HasContent") or condition.startswith("![Window.IsActive(fullscreenvideo)")
+
+
+def getInfoLabel(label):
+    return INFOLABELS.get(label, "")
+
+
+def translatePath(path):
+    root = os.environ.get("BENCHMARK_ROOT", "/tmp/skinhelper-benchmark")
+    if path.startswith("special://"):
+        path = os.path.join(root, path[len("special://"):])
+    return path
+
+
+def sleep(msec):
+    time.sleep(msec / 1000.0)
+
+
+def executebuiltin(command, wait=False):
+    pass
+
+
+def getLocalizedString(string_id):
+    return "string %s" % string_id
+
+
+class Monitor(object):
+
+    def __init__(self, *args, **kwargs):
+        self.abort = False
+
+    def abortRequested(self):
+        return self.abort
+
+    def waitForAbort(self, timeout=None):
+        time.sleep(min(timeout or 0, 0.01))
+        return self.abort
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+
+'''Stand-in for the xbmcaddon module of Kodi: the settings are the defaults of settings.xml'''
+
+import os
+import re
+
+SETTINGS_XML = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "resources", "settings.xml")
+SETTINGS = {}
+
+
+def load_defaults():
+    '''read the default values of all settings'''
+    with open(SETTINGS_XML) as settings_file:
+        for key, value in re.findall(r'id="(\w+)"[^>]*default="([^"]*)"', settings_file.read()):
+            SETTINGS.setdefault(key, value)
+
+load_defaults()
+# the disk caches download the remote art, they are only enabled by the image cache benchmark
+# which serves the art from a local http server
+SETTINGS["imagecache_size"] = "0"
+SETTINGS["scaledcache_size"] = "0"
+
+
+class Addon(object):
+
+    def __init__(self, id=None):
+        self.addon_id = id
+
+    def getSetting(self, key):
+        return SETTINGS.get(key, "")
+
+    def setSetting(self, key, value):
+        SETTINGS[key] = value
+
+    def getAddonInfo(self, key):
+        return ""
+
+    def getLocalizedString(self, string_id):
+        return "string %s" % string_id
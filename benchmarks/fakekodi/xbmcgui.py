@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+
+'''Stand-in for the xbmcgui module of Kodi: the window properties are stored in memory and counted'''
+
+PROPERTIES = {}
+STATS = {"writes": 0}
+INPUT_ALPHANUM = 0
+
+
+class Window(object):
+
+    def __init__(self, window_id=None):
+        self.window_id = window_id
+
+    def setProperty(self, key, value):
+        STATS["writes"] += 1
+        PROPERTIES[key] = value
+
+    def getProperty(self, key):
+        return PROPERTIES.get(key, "")
+
+    def clearProperty(self, key):
+        STATS["writes"] += 1
+        PROPERTIES.pop(key, None)
+
+
+class WindowXMLDialog(object):
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+
+class ListItem(object):
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+
+class Dialog(object):
+    pass
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+'''Stand-in for the xbmcvfs module of Kodi on top of the local filesystem'''
+
+import os
+import shutil
+import xbmc
+
+
+def exists(path):
+    return os.path.exists(xbmc.translatePath(path))
+
+
+def mkdirs(path):
+    path = xbmc.translatePath(path)
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    return True
+
+mkdir = mkdirs
+
+
+def delete(path):
+    try:
+        os.remove(xbmc.translatePath(path))
+    except OSError:
+        return False
+    return True
+
+
+def copy(source, destination):
+    shutil.copy(xbmc.translatePath(source), xbmc.translatePath(destination))
+    return True
+
+
+def rename(source, destination):
+    os.rename(xbmc.translatePath(source), xbmc.translatePath(destination))
+    return True
+
+
+def listdir(path):
+    path = xbmc.translatePath(path)
+    if not os.path.isdir(path):
+        return [], []
+    dirs = []
+    files = []
+    for name in os.listdir(path):
+        if os.path.isdir(os.path.join(path, name)):
+            dirs.append(name)
+        else:
+            files.append(name)
+    return dirs, files
+
+
+class Stat(object):
+
+    def __init__(self, path):
+        self.stat = os.stat(xbmc.translatePath(path))
+
+    def st_mtime(self):
+        return int(self.stat.st_mtime)
+
+    def st_size(self):
+        return self.stat.st_size
+
+
+class File(object):
+
+    def __init__(self, path, mode="r"):
+        self.file = open(xbmc.translatePath(path), mode + "b")
+
+    def read(self):
+        return self.file.read()
+
+    def readBytes(self, numbytes=-1):
+        return self.file.read(numbytes)
+
+    def write(self, data):
+        self.file.write(data)
+        return True
+
+    def size(self):
+        return os.fstat(self.file.fileno()).st_size
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,299 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+    Benchmarks for the backgrounds service, running against a stand-in Kodi runtime (benchmarks/fakekodi)
+    with a synthetic library of configurable size and json latency.
+
+    usage: python2 benchmarks/run_benchmarks.py [--sizes 1000,20000,100000] [--latency 0.01]
+                                                 [--cycles 10] [--walls 2] [--output results.json]
+
+    Every benchmark runs in its own process so the memory peak and the module state are not shared.
+    No benchmark touches the network, the image cache benchmark serves the remote art from a local http server.
+    The results are printed and written as json so runs of different builds and devices can be compared.
+'''
+
+import BaseHTTPServer
+import SocketServer
+import io
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from optparse import OptionParser, SUPPRESS_HELP
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+ADDON_DIR = os.path.dirname(BENCHMARK_DIR)
+BENCHMARKS = ("update_backgrounds", "build_smartshortcuts", "build_wallimages", "image_cache")
+
+
+def setup_runtime(root):
+    '''make the fake kodi modules and the addon modules importable'''
+    os.environ["BENCHMARK_ROOT"] = root
+    sys.path[:0] = [os.path.join(BENCHMARK_DIR, "fakekodi"), os.path.join(ADDON_DIR, "resources", "lib")]
+
+
+def get_peak_memory():
+    '''returns the peak resident memory of this process in KB'''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 if sys.platform == "darwin" else peak
+
+
+def create_updater():
+    '''returns a backgrounds updater with the default settings'''
+    import xbmc
+    from backgrounds_updater import BackgroundsUpdater
+    bgupdater = BackgroundsUpdater(kodimonitor=xbmc.Monitor())
+    bgupdater.get_config()
+    return bgupdater
+
+
+def stop_updater(bgupdater):
+    '''stop the pools of the updater, the updater thread itself was never started'''
+    bgupdater.exit = True
+    bgupdater.fetch_pool.stop()
+    bgupdater.refill_pool.stop()
+    bgupdater.artindex.close()
+
+
+def bench_update_backgrounds(options, result):
+    '''cold and warm backgrounds cycles'''
+    import xbmcgui
+    bgupdater = create_updater()
+    start = time.time()
+    bgupdater.update_backgrounds()
+    result["cold_cycle"] = time.time() - start
+    timings = []
+    for _ in range(options.cycles):
+        start = time.time()
+        bgupdater.update_backgrounds()
+        timings.append(time.time() - start)
+    result["timings"] = timings
+    bgupdater.refill_pool.join(options.timeout)
+    result["images_memory"], result["image_records"] = bgupdater.imagestore.get_memory(bgupdater.pools)
+    result["property_writes"] = xbmcgui.STATS["writes"]
+    stop_updater(bgupdater)
+
+
+def bench_build_smartshortcuts(options, result):
+    '''build the smart shortcuts for a number of favourites'''
+    import xbmc
+    import metadatautils
+    metadatautils.LIBRARY["favourites"] = max(10, options.size / 100)
+    xbmc.CONDITIONS["Skin.HasSetting(SmartShortcuts.favorites)"] = True
+    bgupdater = create_updater()
+    timings = []
+    for _ in range(options.cycles):
+        bgupdater.smartshortcuts.all_nodes = {}
+        start = time.time()
+        bgupdater.smartshortcuts.build_smartshortcuts()
+        timings.append(time.time() - start)
+    result["timings"] = timings
+    result["nodes"] = len(bgupdater.smartshortcuts.get_smartshortcuts_nodes())
+    stop_updater(bgupdater)
+
+
+def create_images(directory, count):
+    '''create a directory with synthetic images for the walls'''
+    from PIL import Image
+    os.makedirs(directory)
+    images = []
+    for index in range(count):
+        path = os.path.join(directory, "image%s.jpg" % index)
+        color = (random.randint(0, 255), random.randint(0, 255), random.randint(0, 255))
+        Image.new("RGB", (480, 270), color).save(path, "JPEG")
+        images.append(path)
+    return images
+
+
+def bench_build_wallimages(options, result):
+    '''build walls from synthetic images'''
+    import wallimages
+    if not wallimages.SUPPORTS_PIL:
+        result["skipped"] = "PIL is not available"
+        return
+    images = create_images(os.path.join(os.environ["BENCHMARK_ROOT"], "images"), min(options.size, 200))
+    bgupdater = create_updater()
+    bgupdater.wallimages.max_wallimages = options.walls
+    timings = []
+    for _ in range(max(1, options.cycles / 5)):
+        start = time.time()
+        walls = bgupdater.wallimages.build_wallimages("SkinHelper.Benchmark.Wall", list(images), "fanart")
+        timings.append(time.time() - start)
+    result["timings"] = timings
+    result["walls"] = len(walls)
+    result["tiles_per_second"] = round(options.walls * 64 / min(timings), 1)
+    stop_updater(bgupdater)
+
+
+class ArtServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    '''local stand-in for the remote art: every url returns the same synthetic jpeg'''
+    daemon_threads = True
+    requests = 0
+    image = ""
+
+
+class ArtRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        self.server.requests += 1
+        self.send_response(200)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(len(self.server.image)))
+        self.end_headers()
+        self.wfile.write(self.server.image)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_art_server():
+    '''start the local http server for the remote art, a full hd+ image so the scaled copies are created'''
+    server = ArtServer(("127.0.0.1", 0), ArtRequestHandler)
+    try:
+        from PIL import Image
+        output = io.BytesIO()
+        Image.new("RGB", (2560, 1440), (40, 80, 120)).save(output, "JPEG")
+        server.image = output.getvalue()
+    except ImportError:
+        server.image = "\xff\xd8\xff\xd9"
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def bench_image_cache(options, result):
+    '''backgrounds cycles with the image cache and the scaled copies of the remote art'''
+    import metadatautils
+    import xbmcaddon
+    server = start_art_server()
+    metadatautils.LIBRARY["art_url"] = "http://127.0.0.1:%s/%%s/%%s.jpg" % server.server_address[1]
+    xbmcaddon.SETTINGS["imagecache_size"] = "100"
+    xbmcaddon.SETTINGS["scaledcache_size"] = "100"
+    bgupdater = create_updater()
+    timings = []
+    for _ in range(options.cycles):
+        start = time.time()
+        bgupdater.update_backgrounds()
+        timings.append(time.time() - start)
+        # the next cycle can use the local copies of the prefetched images
+        bgupdater.imagecache.pool.join(options.timeout)
+        bgupdater.scaledcache.pool.join(options.timeout)
+    result["timings"] = timings
+    counters = bgupdater.stats.snapshot()["counters"]
+    for name in ("imagecache", "scaledimages"):
+        for key in ("hits", "misses", "created", "failed"):
+            result["%s_%s" % (name, key)] = counters.get("%s.%s" % (name, key), 0)
+    result["http_requests"] = server.requests
+    stop_updater(bgupdater)
+    bgupdater.imagecache.stop()
+    bgupdater.scaledcache.stop()
+    server.shutdown()
+
+
+def run_child(options):
+    '''run a single benchmark in this process and print the result as json'''
+    root = tempfile.mkdtemp(prefix="skinhelper-benchmark-")
+    try:
+        setup_runtime(root)
+        import metadatautils
+        metadatautils.LIBRARY["size"] = options.size
+        metadatautils.LIBRARY["latency"] = options.latency
+        metadatautils.LIBRARY["item_latency"] = options.item_latency
+        result = {"benchmark": options.child, "size": options.size, "latency": options.latency,
+                  "item_latency": options.item_latency}
+        memory_before = get_peak_memory()
+        globals()["bench_%s" % options.child](options, result)
+        result["peak_memory_kb"] = get_peak_memory()
+        result["peak_memory_increase_kb"] = result["peak_memory_kb"] - memory_before
+        result["json_calls"] = metadatautils.STATS["calls"]
+        result["json_items"] = metadatautils.STATS["items"]
+        timings = sorted(result.get("timings", []))
+        if timings:
+            result["min"] = timings[0]
+            result["median"] = timings[len(timings) / 2]
+            result["max"] = timings[-1]
+        print(json.dumps(result))
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def run_benchmark(name, size, options):
+    '''run a benchmark in a child process and return its result'''
+    command = [sys.executable, os.path.abspath(__file__), "--child", name, "--size", str(size),
+               "--latency", str(options.latency), "--item-latency", str(options.item_latency),
+               "--cycles", str(options.cycles), "--walls", str(options.walls), "--timeout", str(options.timeout)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = process.communicate()
+    if process.returncode:
+        return {"benchmark": name, "size": size, "error": stderr.strip().splitlines()[-1:]}
+    return json.loads(stdout.strip().splitlines()[-1])
+
+
+def print_result(result):
+    '''print a summary line of a benchmark result'''
+    if "error" in result or "skipped" in result:
+        print("%-22s %8s  %s" % (result["benchmark"], result["size"], result.get("error") or result["skipped"]))
+        return
+    extra = ""
+    if "cold_cycle" in result:
+        extra = "cold %.3fs" % result["cold_cycle"]
+    elif "tiles_per_second" in result:
+        extra = "%s tiles/s" % result["tiles_per_second"]
+    elif "nodes" in result:
+        extra = "%s nodes" % result["nodes"]
+    elif "http_requests" in result:
+        extra = "%s downloads - local copy hits %s - scaled copy hits %s" % (
+            result["imagecache_created"], result["imagecache_hits"], result["scaledimages_hits"])
+    print("%-22s %8s  median %.4fs  max %.4fs  peak %s KB  %s" % (
+        result["benchmark"], result["size"], result["median"], result["max"], result["peak_memory_kb"], extra))
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--sizes", default="1000,20000,100000", help="comma separated library sizes")
+    parser.add_option("--latency", type="float", default=0.01, help="seconds per json call")
+    parser.add_option("--item-latency", dest="item_latency", type="float", default=0.0,
+                      help="seconds per item returned by a json call")
+    parser.add_option("--cycles", type="int", default=10, help="number of measured cycles")
+    parser.add_option("--walls", type="int", default=2, help="number of walls to build")
+    parser.add_option("--timeout", type="int", default=120, help="max seconds to wait for the refills")
+    parser.add_option("--benchmarks", default=",".join(BENCHMARKS), help="comma separated benchmarks to run")
+    parser.add_option("--output", default="", help="write the results as json to this file")
+    parser.add_option("--child", default="", help=SUPPRESS_HELP)
+    parser.add_option("--size", type="int", default=1000, help=SUPPRESS_HELP)
+    options = parser.parse_args()[0]
+
+    if options.child:
+        run_child(options)
+        return
+
+    results = []
+    for name in options.benchmarks.split(","):
+        sizes = [int(size) for size in options.sizes.split(",")]
+        if name == "build_wallimages":
+            # the walls are built from a fixed number of images
+            sizes = sizes[:1]
+        for size in sizes:
+            result = run_benchmark(name, size, options)
+            print_result(result)
+            results.append(result)
+    if options.output:
+        with open(options.output, "w") as output_file:
+            json.dump({"timestamp": int(time.time()), "python": platform.python_version(),
+                       "platform": platform.platform(), "machine": platform.machine(),
+                       "options": {"latency": options.latency, "item_latency": options.item_latency,
+                                   "cycles": options.cycles, "walls": options.walls},
+                       "results": results}, output_file, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
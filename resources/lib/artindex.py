@@ -0,0 +1,374 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+    Shared library-wide art index for the movies and tvshows backgrounds and walls.
+    The art, playcount, resume state and dateadded of all items is stored in a small SQLite database
+    in the addon_data folder so backgrounds and walls can be served from the local index right after login.
+    The index is synced incrementally (by dateadded and library notifications) instead of being rebuilt
+    from scratch and the derived backgrounds (in progress, unwatched, recent) are simple local queries.
+'''
+
+import random
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from utils import log_msg, log_exception
+from sampling import PermutationCursor
+import xbmc
+import xbmcvfs
+
+ARTINDEX_PATH = "artindex://"
+DB_PATH = "special://profile/addon_data/script.skin.helper.backgrounds/"
+DB_FILE = DB_PATH + "artindex.db"
+DB_VERSION = 1
+FULL_SYNC_INTERVAL = 86400  # safety net: full sync of the index once a day
+MAX_ITEM_UPDATES = 50  # above this number of changed items a full sync is cheaper than fetching them one by one
+RECENT_LIMIT = 25  # number of items in the recently added backgrounds, like Kodi's own recently added nodes
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+SQL_MAX_VARIABLES = 500  # max number of ids in a single IN query
+MAX_CURSOR_STEPS = 2000  # filters which need more steps through the id space per batch walk their matching ids
+ART_COLUMNS = ("fanart", "poster", "landscape", "clearlogo", "thumbnail")
+
+# media type --> (json method, details json method, id field, properties)
+MEDIA_TYPES = {
+    "movies": ("VideoLibrary.GetMovies", "VideoLibrary.GetMovieDetails", "movieid",
+               ["title", "art", "fanart", "thumbnail", "playcount", "resume", "dateadded"]),
+    "tvshows": ("VideoLibrary.GetTVShows", "VideoLibrary.GetTVShowDetails", "tvshowid",
+                ["title", "art", "fanart", "thumbnail", "playcount", "dateadded", "episode", "watchedepisodes"])
+}
+
+# where clause for the filters of the derived backgrounds
+FILTERS = {
+    "all": "",
+    "inprogress": "AND inprogress = 1",
+    "unwatched": "AND playcount = 0",
+    "recent": ""
+}
+
+FULL_SYNC = 2
+INCREMENTAL_SYNC = 1
+
+
+def is_inprogress(media):
+    '''in progress: a movie with a resume point or a tvshow which is partly watched'''
+    if "watchedepisodes" in media:
+        return 0 < media["watchedepisodes"] < media.get("episode", 0)
+    return media.get("resume", {}).get("position", 0) > 0
+
+
+class ArtIndex():
+    '''Persistent index of all movies and tvshows with their art, synced incrementally with the Kodi library'''
+
+    def __init__(self, bgupdater):
+        self.bgupdater = bgupdater
+        self.lock = threading.RLock()
+        self.connection = None
+        self.sync_needed = {}  # media type --> INCREMENTAL_SYNC or FULL_SYNC
+        self.sync_busy = set()
+        self.item_updates = {}  # media type --> set of item ids which changed
+        self.cursors = {}  # (media type, filter, art type) --> PermutationCursor over the item id space
+        self.counts = {}  # (media type, where clause) --> number of matching items, cleared when the index changes
+        for media_type in MEDIA_TYPES:
+            # the index from the previous session is served right away and synced in the background
+            self.sync_needed[media_type] = INCREMENTAL_SYNC
+
+    def close(self):
+        '''close the database connection'''
+        with self.lock:
+            if self.connection:
+                self.connection.close()
+                self.connection = None
+
+    def get_connection(self):
+        '''returns the (shared) database connection, creates the database if needed'''
+        if not self.connection:
+            if not xbmcvfs.exists(DB_PATH):
+                xbmcvfs.mkdirs(DB_PATH)
+            db_file = xbmc.translatePath(DB_FILE).decode("utf-8")
+            self.connection = sqlite3.connect(db_file, check_same_thread=False)
+            self.connection.text_factory = unicode
+            self.create_tables()
+        return self.connection
+
+    def create_tables(self):
+        '''create the tables in the database, the tables are recreated if the version doesn't match'''
+        cursor = self.connection.cursor()
+        cursor.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        version = cursor.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if not version or int(version[0]) != DB_VERSION:
+            cursor.execute("DROP TABLE IF EXISTS items")
+            cursor.execute("DELETE FROM meta")
+            cursor.execute("INSERT INTO meta (key, value) VALUES ('version', ?)", (str(DB_VERSION),))
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS items (mediatype TEXT, itemid INTEGER, title TEXT, fanart TEXT, "
+            "poster TEXT, landscape TEXT, clearlogo TEXT, thumbnail TEXT, playcount INTEGER, "
+            "inprogress INTEGER, dateadded TEXT, PRIMARY KEY (mediatype, itemid))")
+        cursor.execute("CREATE INDEX IF NOT EXISTS items_dateadded ON items (mediatype, dateadded)")
+        self.connection.commit()
+
+    def on_library_changed(self, event, media_type, item_id=None):
+        '''process a library notification: removed items are deleted directly, other changes are synced'''
+        if media_type in ("episode", "season"):
+            # the watched state of the tvshow changed, we can not map the episode to its tvshow cheaply
+            self.request_sync("tvshows", FULL_SYNC)
+            return
+        index_type = {"movie": "movies", "tvshow": "tvshows"}.get(media_type)
+        if index_type and item_id and event == "OnRemove":
+            with self.lock:
+                cursor = self.get_connection().cursor()
+                cursor.execute("DELETE FROM items WHERE mediatype = ? AND itemid = ?", (index_type, item_id))
+                self.connection.commit()
+                self.counts = {}
+        elif index_type and item_id and event == "OnUpdate":
+            with self.lock:
+                self.item_updates.setdefault(index_type, set()).add(item_id)
+            self.request_sync(index_type, INCREMENTAL_SYNC)
+        elif event == "OnScanFinished":
+            for key in ([index_type] if index_type else MEDIA_TYPES.keys()):
+                self.request_sync(key, INCREMENTAL_SYNC)
+        else:
+            # clean finished or unknown change: full sync to pick up all removed items
+            for key in ([index_type] if index_type else MEDIA_TYPES.keys()):
+                self.request_sync(key, FULL_SYNC)
+
+    def request_sync(self, media_type, sync_type):
+        '''flag the media type for a (full or incremental) sync on next use'''
+        with self.lock:
+            self.sync_needed[media_type] = max(sync_type, self.sync_needed.get(media_type, 0))
+
+    def get_meta(self, key, default=""):
+        '''get a value from the meta table'''
+        result = self.get_connection().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return result[0] if result else default
+
+    def set_meta(self, key, value):
+        '''store a value in the meta table'''
+        self.get_connection().execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def count(self, media_type, item_filter="all"):
+        '''returns the number of indexed items with a fanart image'''
+        count = self.count_where(media_type, "mediatype = ? AND fanart != '' %s" % FILTERS[item_filter])
+        return min(count, RECENT_LIMIT) if item_filter == "recent" else count
+
+    def count_where(self, media_type, where):
+        '''returns the number of indexed items matching the where clause, cached until the index changes'''
+        with self.lock:
+            count = self.counts.get((media_type, where))
+            if count is None:
+                count = self.get_connection().execute(
+                    "SELECT COUNT(*) FROM items WHERE %s" % where, (media_type,)).fetchone()[0]
+                self.counts[(media_type, where)] = count
+        return count
+
+    def check_sync(self, media_type):
+        '''make sure the index is in sync, an empty index is built directly, other syncs run in the background'''
+        with self.lock:
+            if not self.get_meta("lastsync.%s" % media_type):
+                # nothing indexed yet, we have to wait for the index to be built (other threads wait for the lock)
+                self.sync(media_type, FULL_SYNC)
+                return
+            if time.time() - float(self.get_meta("fullsync.%s" % media_type, "0")) > FULL_SYNC_INTERVAL:
+                self.sync_needed[media_type] = FULL_SYNC
+            if not self.sync_needed.get(media_type) or media_type in self.sync_busy:
+                return
+            self.sync_busy.add(media_type)
+        if not self.bgupdater.refill_pool.submit(self.background_sync, media_type):
+            self.sync_busy.discard(media_type)
+
+    def background_sync(self, media_type):
+        '''executed by the refill pool: sync the index for the given media type'''
+        try:
+            with self.lock:
+                sync_type = self.sync_needed.get(media_type)
+            if sync_type:
+                self.sync(media_type, sync_type)
+        finally:
+            self.sync_busy.discard(media_type)
+
+    def sync_pending(self):
+        '''directly process all pending syncs, e.g. before refreshing the backgrounds after a library change'''
+        for media_type in MEDIA_TYPES:
+            with self.lock:
+                if not self.sync_needed.get(media_type) or media_type in self.sync_busy:
+                    continue
+                self.sync_busy.add(media_type)
+            self.background_sync(media_type)
+
+    def sync(self, media_type, sync_type):
+        '''sync the index with the Kodi library'''
+        json_method, details_method, id_field, fields = MEDIA_TYPES[media_type]
+        with self.lock:
+            self.sync_needed.pop(media_type, None)
+            item_updates = self.item_updates.pop(media_type, set())
+            last_dateadded = self.get_meta("dateadded.%s" % media_type)
+        if len(item_updates) > MAX_ITEM_UPDATES:
+            sync_type = FULL_SYNC
+        if sync_type == FULL_SYNC or not last_dateadded:
+            items = self.bgupdater.get_json(json_method, returntype=media_type, fields=fields) or []
+        else:
+            # only fetch the items which were added since the last sync (with a margin of a day)
+            since = datetime(*(time.strptime(last_dateadded, DATE_FORMAT)[0:6])) - timedelta(days=1)
+            items = self.bgupdater.get_json(
+                json_method, returntype=media_type, fields=fields,
+                filters=[{"field": "dateadded", "operator": "after", "value": since.strftime(DATE_FORMAT)}]) or []
+            for item_id in item_updates:
+                details = self.bgupdater.get_json(
+                    details_method, returntype=details_method.split(".")[-1].lower()[3:],
+                    fields=fields, optparam=(id_field, item_id))
+                if details:
+                    items.append(details)
+        rows = [self.get_row(media_type, id_field, media) for media in items if media.get(id_field)]
+        with self.lock:
+            try:
+                cursor = self.get_connection().cursor()
+                if sync_type == FULL_SYNC:
+                    cursor.execute("DELETE FROM items WHERE mediatype = ?", (media_type,))
+                    self.set_meta("fullsync.%s" % media_type, str(time.time()))
+                cursor.executemany("INSERT OR REPLACE INTO items VALUES (?,?,?,?,?,?,?,?,?,?,?)", rows)
+                dateadded = cursor.execute(
+                    "SELECT MAX(dateadded) FROM items WHERE mediatype = ?", (media_type,)).fetchone()[0]
+                self.set_meta("dateadded.%s" % media_type, dateadded or "")
+                self.set_meta("lastsync.%s" % media_type, str(time.time()))
+                self.connection.commit()
+                self.counts = {}
+            except Exception as exc:
+                self.connection.rollback()
+                log_exception(__name__, exc)
+        log_msg("ArtIndex - %s sync of %s: %s items updated" %
+                ("full" if sync_type == FULL_SYNC else "incremental", media_type, len(rows)))
+
+    def get_row(self, media_type, id_field, media):
+        '''convert the media item from the Kodi json api to a row in the index'''
+        clean_image = self.bgupdater.get_clean_image
+        image = self.bgupdater.get_image_from_media(media) or {}
+        art = media.get("art", {})
+        return (media_type, media[id_field], media.get("title") or media.get("label", ""),
+                image.get("fanart", ""),
+                image.get("poster") or clean_image(art.get("poster", "")),
+                image.get("landscape") or clean_image(art.get("landscape", "")),
+                image.get("clearlogo") or clean_image(art.get("clearlogo", "")),
+                image.get("thumbnail", ""),
+                media.get("playcount") or 0, int(is_inprogress(media)), media.get("dateadded", ""))
+
+    def query(self, media_type, item_filter, count, art_column="fanart"):
+        '''returns the next rows from the index for the given media type and filter'''
+        self.check_sync(media_type)
+        columns = "itemid, title, fanart, poster, landscape, clearlogo, thumbnail"
+        where = "mediatype = ? AND %s != '' %s" % (art_column, FILTERS[item_filter])
+        with self.lock:
+            connection = self.get_connection()
+            if item_filter == "recent":
+                rows = connection.execute("SELECT %s FROM items WHERE %s ORDER BY dateadded DESC LIMIT ?" %
+                                          (columns, where), (media_type, min(count, RECENT_LIMIT))).fetchall()
+                return [row[1:] for row in rows]
+            total = self.count_where(media_type, where)
+            if total <= count:
+                # all matching items fit in one batch, the pool keeps them in memory and shuffles them
+                rows = connection.execute("SELECT %s FROM items WHERE %s" % (columns, where), (media_type,)).fetchall()
+                random.shuffle(rows)
+                return [row[1:] for row in rows]
+            max_id = connection.execute(
+                "SELECT MAX(itemid) FROM items WHERE mediatype = ?", (media_type,)).fetchone()[0]
+            id_space = 4
+            while id_space <= max_id:
+                id_space *= 2
+            key = (media_type, item_filter, art_column)
+            if count * id_space > total * MAX_CURSOR_STEPS:
+                # sparse filter (e.g. the in progress items): most ids of the id space don't match,
+                # walk a permutation of the matching ids instead, there are only few of them
+                item_ids = [row[0] for row in connection.execute(
+                    "SELECT itemid FROM items WHERE %s ORDER BY itemid" % where, (media_type,))]
+                cursor = self.cursors.get(key + ("sparse",))
+                if not cursor:
+                    cursor = PermutationCursor(len(item_ids))
+                    self.cursors[key + ("sparse",)] = cursor
+                selected = [item_ids[index] for index in cursor.take(count, len(item_ids))]
+                rows = self.get_rows(connection, columns, "mediatype = ?", media_type, selected)
+                return [rows[item_id] for item_id in selected if item_id in rows]
+            return self.take_rows(key, connection, columns, where, media_type, id_space, total, count)
+
+    def take_rows(self, key, connection, columns, where, media_type, id_space, total, count):
+        '''returns the next (max count) matching rows from the permutation of the item id space.
+           the candidate ids are checked in chunks and the ids which don't match (anymore) are skipped,
+           so a changed filter result (e.g. an item was watched) doesn't restart the permutation,
+           only an id space which outgrows the cursor does'''
+        cursor = self.cursors.get(key)
+        if not cursor or cursor.size < id_space:
+            cursor = PermutationCursor(id_space)
+            self.cursors[key] = cursor
+        result = []
+        seen = set()
+        steps = 0
+        # at most one full period, a new permutation is started once all ids were visited
+        while len(result) < count and steps < cursor.size:
+            if cursor.position >= cursor.size:
+                cursor.reset(cursor.size)
+            # enough candidates for the missing rows, based on the share of the id space which matches
+            needed = (count - len(result)) * id_space // total + 1
+            candidates = cursor.peek(min(SQL_MAX_VARIABLES, needed + needed // 4 + 8, cursor.size - steps))
+            rows = self.get_rows(connection, columns, where, media_type, candidates)
+            used = 0
+            for item_id in candidates:
+                used += 1
+                if item_id in rows and item_id not in seen:
+                    seen.add(item_id)
+                    result.append(rows[item_id])
+                    if len(result) >= count:
+                        break
+            # only advance the cursor over the candidates we used, the others are the start of the next batch
+            for _ in xrange(used):
+                cursor.next()
+            steps += used
+        return result
+
+    @staticmethod
+    def get_rows(connection, columns, where, media_type, item_ids):
+        '''returns the rows (without the item id) of the given item ids which match the where clause, by id'''
+        rows = {}
+        for start in range(0, len(item_ids), SQL_MAX_VARIABLES):
+            chunk = item_ids[start:start + SQL_MAX_VARIABLES]
+            for row in connection.execute(
+                    "SELECT %s FROM items WHERE %s AND itemid IN (%s)" % (columns, where, ",".join("?" * len(chunk))),
+                    [media_type] + chunk):
+                rows[row[0]] = row[1:]
+        return rows
+
+    @staticmethod
+    def parse_path(lib_path):
+        '''returns the media type and filter for an artindex path, e.g. artindex://movies/inprogress'''
+        media_type, item_filter = lib_path[len(ARTINDEX_PATH):].strip("/").split("/")
+        return media_type, item_filter
+
+    def get_images(self, lib_path, count):
+        '''get (max count) random images for the given artindex path'''
+        media_type, item_filter = self.parse_path(lib_path)
+        result = []
+        for row in self.query(media_type, item_filter, count):
+            image = {"title": row[0]}
+            for key, value in zip(ART_COLUMNS, row[1:]):
+                image[key] = value
+            result.append(image)
+        return result
+
+    def get_art(self, lib_path, art_type, count=None):
+        '''get the distinct images (max count random ones) of the given art type for the given artindex path.
+           used for the walls, they don't use a cursor so they don't interfere with the rotation of the backgrounds'''
+        media_type, item_filter = self.parse_path(lib_path)
+        column = ART_COLUMNS[ART_COLUMNS.index("thumbnail" if art_type == "thumb" else art_type)]
+        self.check_sync(media_type)
+        sql = "SELECT %s FROM items WHERE mediatype = ? AND %s != '' %s" % (column, column, FILTERS[item_filter])
+        if item_filter == "recent":
+            sql += " ORDER BY dateadded DESC LIMIT %s" % RECENT_LIMIT
+        with self.lock:
+            rows = self.get_connection().execute(sql, (media_type,)).fetchall()
+        result = []
+        seen = set()
+        for row in rows:
+            if row[0] not in seen:
+                seen.add(row[0])
+                result.append(row[0])
+        if count and len(result) > count:
+            result = random.sample(result, count)
+        return result
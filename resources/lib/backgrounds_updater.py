@@ -9,57 +9,143 @@
 import thread
 import threading
 import random
-import os
+import time
+from functools import partial
 from datetime import timedelta
-from utils import log_msg, log_exception, get_content_path, urlencode, ADDON_ID
+from utils import log_msg, log_exception, get_content_path, LRUCache, ADDON_ID
 import xbmc
-import xbmcvfs
 import xbmcaddon
 import xbmcgui
 from simplecache import SimpleCache
 from conditional_backgrounds import get_cond_background
 from smartshortcuts import SmartShortCuts
 from wallimages import WallImages
+from workerpool import WorkerPool
+from propertywriter import PropertyWriter
+from scheduler import Scheduler
+from artindex import ArtIndex, ARTINDEX_PATH
+from picturesindex import PicturesIndex
+from sampling import ShuffleCursor, AliasSampler
+from pools import PoolRegistry
+from records import ImageStore
+from stats import Metrics, get_source_name
+from imagecache import ImageCache, ScaledImageCache
 from metadatautils import MetadataUtils
 
+IMAGE_KEYS = ("title", "landscape", "poster", "clearlogo", "thumbnail")
+WINPROPS_CACHE_VERSION = 2
+DELAYED_TASK_INTERVAL = 120  # reading the config and building the smart shortcuts
+FULLSCREEN_RETRY_DELAY = 10  # check again after this amount of seconds if the job was skipped for fullscreen video
+REFRESH_SMARTSHORTCUTS_INTERVAL = 5  # check for a refresh request of the smart shortcuts by the skin
+PICTURES_CRAWL_INTERVAL = 3600  # update the pictures index in the background
+STATS_INTERVAL = 300  # publish and dump the performance metrics
+
+# interval in seconds to refresh the images of a background source, sources with content that changes
+# often are refreshed more frequently, the others are only refreshed by the low watermark refill
+SOURCE_REFRESH_INTERVALS = {
+    "SkinHelper.RecentMoviesBackground": 600,
+    "SkinHelper.RecentEpisodesBackground": 600,
+    "SkinHelper.RecentMusicBackground": 900,
+    "SkinHelper.InProgressMoviesBackground": 600,
+    "SkinHelper.InProgressShowsBackground": 600,
+    "SkinHelper.PvrBackground": 900,
+    "SkinHelper.TopRatedMovies": 14400,
+    "SkinHelper.TopRatedShows": 14400
+}
+SOURCE_REFRESH_DEFAULT = 3600
+LONG_TTL_STREAK = 3  # after this number of fetches with less images than requested the source is considered small
+LONG_TTL_INTERVAL = 21600  # refresh interval of the small sources, their images are all in memory anyway
+
+# the number of images fetched for a source adapts to how fast its images are used and how slow the source is
+MIN_PREFETCH = 10
+MAX_PREFETCH = 120
+PREFETCH_TARGET_TIME = 900  # a batch of images should last this number of seconds
+SLOW_FETCH_TIME = 2.0  # sources which take longer than this to fetch get proportionally bigger batches
+MIN_MEMORY_SCALE = 0.05  # the memory budget shrinks the batches of the pools to no less than this share
+MEMORY_HEADROOM = 0.6  # the batches grow again while the images use less than this share of the memory budget
+
+# the refreshes are postponed while the backgrounds cycles overrun their interval or the system is busy
+BACKOFF_DELAY = 60
+MAX_BACKOFF = 16
+REFILL_BACKLOG = 10  # max number of queued refills before the system is considered busy
+IMAGECACHE_PREFETCH = 3  # number of upcoming images of each background to download into the local image cache
+CLEAN_IMAGE_CACHE_SIZE = 5000  # number of normalized image urls to keep in memory
+LIBRARY_CHANGE_DELAY = 10  # wait for more library notifications before refreshing the affected backgrounds
+# sources served by the Kodi databases, only for these the total number of items is asked separately
+LIBRARY_PATHS = ("videodb://", "musicdb://", "library://", "special://")
+
+# library path fragments of the backgrounds affected by a change of the given video media type
+VIDEO_MEDIA_PATHS = {
+    "movie": ("movies", "recentlyaddedmovies"),
+    "tvshow": ("tvshows", "recentlyaddedepisodes", "episodes", "inprogresstvshows"),
+    "season": ("tvshows", "recentlyaddedepisodes", "episodes", "inprogresstvshows"),
+    "episode": ("tvshows", "recentlyaddedepisodes", "episodes", "inprogresstvshows"),
+    "musicvideo": ("musicvideos", "recentlyaddedmusicvideos")
+}
+
 
 class BackgroundsUpdater(threading.Thread):
     '''Background service providing rotating backgrounds to Kodi skins'''
     exit = False
     event = None
-    all_backgrounds = {}
-    all_backgrounds2 = {}
-    all_backgrounds_labels = []
     backgrounds_delay = 0
     walls_delay = 30
     enable_walls = False
-    all_backgrounds_keys = {}
     prefetch_images = 30  # number of images to cache in memory for each library path
     pvr_bg_recordingsonly = False
     custom_picturespath = ""
-    winprops = {}
+    pictures_depth = 3  # max depth of subdirectories to index in the picture sources
+    fetch_threads = 4  # number of worker threads used to fetch the background images in parallel
+    fetch_timeout = 30  # max number of seconds each backgrounds cycle waits for the fetches to finish
+    refill_watermark = 25  # refill a pool in the background once it drops below this percentage of prefetch_images
+    backoff = 1  # multiplier for the refresh delay while the system is busy
+    overruns = 0  # number of consecutive backgrounds cycles which took longer than their interval
+    memory_budget = 0  # max megabytes for the images in memory, the pools keep smaller batches when it is exceeded
+    memory_scale = 1.0  # share of the regular batch size the pools keep, lowered by the memory budget
 
     def __init__(self, *args, **kwargs):
+        self.stats = Metrics()
+        self.pools = PoolRegistry()
+        self.imagestore = ImageStore()
+        self.clean_images = LRUCache(CLEAN_IMAGE_CACHE_SIZE)
+        self.winprops = {}
+        self.dirty_winprops = set()  # keys changed since the window props were last saved to the cache
+        self.library_changes = {}  # backgrounds to refresh after a library change, win_prop --> lib_path
+        self.refill_lock = threading.Lock()
         self.cache = SimpleCache()
         self.mutils = MetadataUtils()
         self.win = xbmcgui.Window(10000)
+        self.propwriter = PropertyWriter(self.win)
         self.addon = xbmcaddon.Addon(ADDON_ID)
         self.smartshortcuts = SmartShortCuts(self)
         self.wallimages = WallImages(self)
+        self.artindex = ArtIndex(self)
+        self.picturesindex = PicturesIndex(self)
+        self.imagecache = ImageCache(self)
+        self.scaledcache = ScaledImageCache(self)
         self.kodimonitor = kwargs.get("kodimonitor")
         self.event = threading.Event()
+        self.scheduler = Scheduler(self.event)
+        self.fetch_pool = WorkerPool(self.fetch_threads)
+        self.refill_pool = WorkerPool(2, name="SkinHelperBackgrounds.Refill")
         threading.Thread.__init__(self, *args)
 
     def stop(self):
         '''stop running our background service '''
         self.smartshortcuts.exit = True
-        self.wallimages.exit = True
+        self.wallimages.stop()
         self.exit = True
+        self.fetch_pool.stop()
+        self.refill_pool.stop()
+        self.imagecache.stop()
+        self.scaledcache.stop()
+        self.artindex.close()
         self.event.set()
-        self.event.clear()
         self.join(0.5)
+        self.pools.clear()
         del self.smartshortcuts
         del self.wallimages
+        del self.propwriter
         del self.win
         del self.addon
 
@@ -68,53 +154,120 @@ class BackgroundsUpdater(threading.Thread):
         log_msg("BackgroundsUpdater - started", xbmc.LOGNOTICE)
         self.winpropcache()
         self.get_config()
-        backgrounds_task_interval = 0
-        walls_task_interval = 0
-        delayed_task_interval = 112
+        self.scheduler.add_job("delayed", self.delayed_task, DELAYED_TASK_INTERVAL, delay=8)
+        self.scheduler.add_job("refreshsmartshortcuts", self.refresh_smartshortcuts, REFRESH_SMARTSHORTCUTS_INTERVAL)
+        self.scheduler.add_job("picturesindex", self.pictures_task, PICTURES_CRAWL_INTERVAL)
+        self.scheduler.add_job("stats", self.stats_task, STATS_INTERVAL)
+        self.schedule_jobs()
 
         while not self.exit:
-
-            # Process backgrounds only if we're not watching fullscreen video
-            if xbmc.getCondVisibility(
-                "![Window.IsActive(fullscreenvideo) | Window.IsActive(script.pseudotv.TVOverlay.xml) | "
-                    "Window.IsActive(script.pseudotv.live.TVOverlay.xml)] | "
-                    "Window.IsActive(script.pseudotv.live.EPG.xml)"):
-
-                # background stuff like reading the skin settings and generating smart shortcuts
-                if delayed_task_interval >= 120:
-                    delayed_task_interval = 0
-                    self.get_config()
-                    self.report_allbackgrounds()
-                    self.smartshortcuts.build_smartshortcuts()
-                    self.report_allbackgrounds()
-                    self.winpropcache(True)
-                    
-                if self.exit:
-                    break
-
-                # force refresh smart shortcuts on request
-                if self.win.getProperty("refreshsmartshortcuts"):
-                    self.win.clearProperty("refreshsmartshortcuts")
-                    self.smartshortcuts.build_smartshortcuts()
-
-                # Update home backgrounds every interval (if enabled by skinner)
-                if self.backgrounds_delay and backgrounds_task_interval >= self.backgrounds_delay:
-                    backgrounds_task_interval = 0
-                    self.update_backgrounds()
-                    
-                if self.exit:
-                    break
-
-                # Update wall images every interval (if enabled by skinner)
-                if self.enable_walls and self.walls_delay and (walls_task_interval >= self.walls_delay):
-                    walls_task_interval = 0
-                    thread.start_new_thread(self.wallimages.update_wallbackgrounds, ())
-                    self.wallimages.update_manualwalls()
-
-            self.kodimonitor.waitForAbort(1)
-            backgrounds_task_interval += 1
-            walls_task_interval += 1
-            delayed_task_interval += 1
+            self.scheduler.run_pending(lambda: self.exit)
+            # write all window property changes of the executed jobs in one batch
+            self.propwriter.flush()
+            if not self.exit:
+                # sleep until the next job is due
+                self.scheduler.wait()
+
+    def schedule_jobs(self):
+        '''(re)schedule the rotation jobs with the intervals from the config'''
+        # Update home backgrounds every interval (if enabled by skinner)
+        if self.backgrounds_delay:
+            self.scheduler.set_job("backgrounds", self.backgrounds_task, self.backgrounds_delay)
+        else:
+            self.scheduler.remove_job("backgrounds")
+        # Update wall images every interval (if enabled by skinner)
+        if self.enable_walls and self.walls_delay:
+            self.scheduler.set_job("walls", self.walls_task, self.walls_delay)
+            self.scheduler.set_job("manualwalls", self.manualwalls_task, self.walls_delay)
+        else:
+            self.scheduler.remove_job("walls")
+            self.scheduler.remove_job("manualwalls")
+
+    @staticmethod
+    def gui_active():
+        '''Process backgrounds only if we're not watching fullscreen video'''
+        return xbmc.getCondVisibility(
+            "![Window.IsActive(fullscreenvideo) | Window.IsActive(script.pseudotv.TVOverlay.xml) | "
+            "Window.IsActive(script.pseudotv.live.TVOverlay.xml)] | "
+            "Window.IsActive(script.pseudotv.live.EPG.xml)")
+
+    def delayed_task(self):
+        '''background stuff like reading the skin settings and generating smart shortcuts'''
+        if not self.gui_active():
+            return FULLSCREEN_RETRY_DELAY
+        self.get_config()
+        self.schedule_jobs()
+        self.check_memory_budget()
+        self.report_allbackgrounds()
+        self.smartshortcuts.build_smartshortcuts()
+        self.report_allbackgrounds()
+        self.winpropcache(True)
+        log_msg("Window properties written: %s - skipped: %s" % self.propwriter.get_stats())
+        log_msg("Clean image cache - entries: %s - hits: %s - misses: %s" % self.clean_images.get_stats())
+
+    def refresh_smartshortcuts(self):
+        '''force refresh smart shortcuts on request'''
+        if self.win.getProperty("refreshsmartshortcuts") and self.gui_active():
+            self.win.clearProperty("refreshsmartshortcuts")
+            self.smartshortcuts.build_smartshortcuts()
+
+    def backgrounds_task(self):
+        '''rotate the backgrounds'''
+        if not self.gui_active():
+            return FULLSCREEN_RETRY_DELAY
+        start = time.time()
+        self.update_backgrounds()
+        duration = time.time() - start
+        self.stats.observe("cycle.backgrounds", duration * 1000)
+        self.overruns = self.overruns + 1 if duration > self.backgrounds_delay else 0
+        self.update_backoff()
+
+    def is_busy(self):
+        '''check if the service or the system is under load'''
+        return (self.overruns > 0 or self.refill_pool.pending > REFILL_BACKLOG or
+                xbmc.getCondVisibility("Library.IsScanning"))
+
+    def update_backoff(self):
+        '''double the refresh backoff while busy, decrease it again once the load is gone'''
+        if self.is_busy():
+            if self.backoff < MAX_BACKOFF:
+                self.backoff *= 2
+                log_msg("Service is busy - postponing the refreshes (backoff %sx)" % self.backoff)
+        elif self.backoff > 1:
+            self.backoff /= 2
+
+    def walls_task(self):
+        '''rotate the wall images, (re)building them in the background when needed'''
+        if not self.gui_active():
+            return FULLSCREEN_RETRY_DELAY
+        thread.start_new_thread(self.wallimages.update_wallbackgrounds, ())
+
+    def manualwalls_task(self):
+        '''rotate the images of the manual walls'''
+        if not self.gui_active():
+            return FULLSCREEN_RETRY_DELAY
+        self.wallimages.update_manualwalls()
+
+    def pictures_task(self):
+        '''update the pictures index, postponed during fullscreen video as it lists the (network) picture sources'''
+        if not self.gui_active():
+            return FULLSCREEN_RETRY_DELAY
+        self.picturesindex.schedule_crawl()
+
+    def stats_task(self):
+        '''publish the performance metrics as window properties and dump them to disk'''
+        written, skipped = self.propwriter.get_stats()
+        self.stats.set_value("winprops.written", written)
+        self.stats.set_value("winprops.skipped", skipped)
+        _, hits, misses = self.clean_images.get_stats()
+        self.stats.set_value("cleanimage.hits", hits)
+        self.stats.set_value("cleanimage.misses", misses)
+        self.stats.set_value("pools.loaded", len([pool for pool in self.pools if pool.images]))
+        self.stats.publish(self.propwriter)
+        try:
+            self.stats.dump()
+        except Exception as exc:
+            log_exception(__name__, exc)
 
     def get_config(self):
         '''gets various settings for the script as set by the skinner or user'''
@@ -127,7 +280,20 @@ class BackgroundsUpdater(threading.Thread):
 
         self.walls_delay = int(self.addon.getSetting("wallimages_delay"))
         self.wallimages.max_wallimages = int(self.addon.getSetting("max_wallimages"))
+        self.wallimages.render_processes = int(self.addon.getSetting("wall_processes"))
         self.pvr_bg_recordingsonly = self.addon.getSetting("pvr_bg_recordingsonly") == "true"
+        self.fetch_threads = int(self.addon.getSetting("fetch_threads"))
+        self.fetch_timeout = int(self.addon.getSetting("fetch_timeout"))
+        self.fetch_pool.resize(self.fetch_threads)
+        self.refill_watermark = int(self.addon.getSetting("refill_watermark"))
+        self.pictures_depth = int(self.addon.getSetting("pictures_depth"))
+        self.memory_budget = int(self.addon.getSetting("memory_budget"))
+        self.imagecache.max_size = int(self.addon.getSetting("imagecache_size")) * 1024 * 1024
+        self.scaledcache.max_size = int(self.addon.getSetting("scaledcache_size")) * 1024 * 1024
+        self.scaledcache.update_screen_size()
+        for diskcache in (self.imagecache, self.scaledcache):
+            if diskcache.loaded:
+                diskcache.evict()
         self.enable_walls = xbmc.getCondVisibility("Skin.HasSetting(SkinHelper.EnableWallBackgrounds)")
         if self.addon.getSetting("enable_custom_images_path") == "true":
             self.custom_picturespath = self.addon.getSetting("custom_images_path")
@@ -137,46 +303,57 @@ class BackgroundsUpdater(threading.Thread):
             # skinner can enable manual wall images generation so check for these settings
             # store in memory so wo do not have to query the skin settings too often
             if self.walls_delay:
-                for key in self.all_backgrounds_keys.iterkeys():
-                    limitrange = xbmc.getInfoLabel("Skin.String(%s.EnableWallImages)" % key)
-                    if limitrange:
-                        self.wallimages.manual_walls[key] = int(limitrange)
+                for pool in self.pools:
+                    if pool.lib_path:
+                        limitrange = xbmc.getInfoLabel("Skin.String(%s.EnableWallImages)" % pool.win_prop)
+                        if limitrange:
+                            pool.wall_limit = int(limitrange)
         except Exception as exc:
             log_exception(__name__, exc)
 
     def report_allbackgrounds(self):
         '''sets a list of all known backgrounds as winprop to be retrieved from skinshortcuts'''
-        if self.all_backgrounds_labels:
-            self.set_winprop("SkinHelper.AllBackgrounds", repr(self.all_backgrounds_labels))
+        if self.pools.labels:
+            self.set_winprop("SkinHelper.AllBackgrounds", repr(self.pools.labels))
 
     def set_winprop(self, key, value):
         '''sets a window property and writes it to our global list'''
         if self.exit:
             return
-        self.winprops[key] = value
-        if isinstance(value, unicode):
-            value = value.encode("utf-8")
-        self.win.setProperty(key, value)
+        if self.winprops.get(key, "") != value:
+            # empty values are not stored so the cached snapshot stays compact
+            if value:
+                self.winprops[key] = value
+            else:
+                self.winprops.pop(key, None)
+            self.dirty_winprops.add(key)
+        self.propwriter.set(key, value)
 
     def winpropcache(self, setcache=False):
         '''sets/gets the current window props in a global cache to load them immediately at startup'''
         cachestr = "skinhelper.backgrounds.%s" % xbmc.getInfoLabel("System.ProfileName")
         if setcache:
-            self.cache.set(cachestr, self.winprops)
+            # only save if something changed since the last save
+            if self.dirty_winprops:
+                dirty_count = len(self.dirty_winprops)
+                self.dirty_winprops = set()
+                self.cache.set(cachestr, {"version": WINPROPS_CACHE_VERSION, "winprops": dict(self.winprops)})
+                log_msg("Saved %s window props to the cache (%s changed)" % (len(self.winprops), dirty_count))
         else:
             cache = self.cache.get(cachestr)
             if cache:
+                if cache.get("version") == WINPROPS_CACHE_VERSION:
+                    cache = cache["winprops"]
+                # restore all props in one batch so they are available before the home screen is drawn
                 for key, value in cache.iteritems():
                     if value:
-                        if isinstance(value, unicode):
-                            value = value.encode("utf-8")
-                        if isinstance(key, unicode):
-                            key = key.encode("utf-8")
-                        self.win.setProperty(key, value)
+                        self.propwriter.set(key, value)
+                self.propwriter.flush()
 
-    def get_images_from_vfspath(self, lib_path):
+    def get_images_from_vfspath(self, lib_path, count=None):
         '''get all images from the given vfs path'''
         result = []
+        count = count or self.prefetch_images
         # safety check: check if no library windows are active to prevent any addons setting the view
         if (xbmc.getCondVisibility("Window.IsMedia") and "plugin" in lib_path) or self.exit:
             return result
@@ -186,169 +363,401 @@ class BackgroundsUpdater(threading.Thread):
         if "plugin.video.emby" in lib_path and "browsecontent" in lib_path and "filter" not in lib_path:
             lib_path = lib_path + "&filter=random"
 
-        items = self.mutils.kodidb.get_json("Files.GetDirectory", returntype="", optparam=("directory", lib_path),
-                                     fields=["title", "art", "thumbnail", "fanart"],
-                                     sort={"method": "random", "order": "descending"},
-                                     limits=(0, self.prefetch_images*2))
+        items = self.get_json("Files.GetDirectory", returntype="", optparam=("directory", lib_path),
+                              fields=["title", "art", "thumbnail", "fanart"],
+                              sort={"method": "random", "order": "descending"},
+                              limits=(0, count*2))
         for media in items:
-            image = {}
             if media['label'].lower() == "next page":
                 continue
-            if media.get('art'):
-                if media['art'].get('fanart'):
-                    image["fanart"] = self.mutils.get_clean_image(media['art']['fanart'])
-                elif media['art'].get('tvshow.fanart'):
-                    image["fanart"] = self.mutils.get_clean_image(media['art']['tvshow.fanart'])
-                elif media['art'].get('artist.fanart'):
-                    image["fanart"] = self.mutils.get_clean_image(media['art']['artist.fanart'])
-                if media['art'].get('thumb'):
-                    image["thumbnail"] = self.mutils.get_clean_image(media['art']['thumb'])
-            if not image.get('fanart') and media.get("fanart"):
-                image["fanart"] = self.mutils.get_clean_image(media['fanart'])
-            if not image.get("thumbnail") and media.get("thumbnail"):
-                image["thumbnail"] = self.mutils.get_clean_image(media["thumbnail"])
-
+            image = self.get_image_from_media(media)
             # only append items which have a fanart image
-            if image.get("fanart"):
-                # also append other art to the dict
-                image["title"] = media.get('title', '')
-                if not image.get("title"):
-                    image["title"] = media.get('label', '')
-                image["landscape"] = self.mutils.get_clean_image(media.get('art', {}).get('landscape', ''))
-                image["poster"] = self.mutils.get_clean_image(media.get('art', {}).get('poster', ''))
-                image["clearlogo"] = self.mutils.get_clean_image(media.get('art', {}).get('clearlogo', ''))
+            if image:
                 result.append(image)
-            if len(result) == self.prefetch_images:
+            if len(result) == count:
                 break
         random.shuffle(result)
         return result
 
-    def get_pictures(self):
-        '''get images we can use as pictures background'''
-        images = []
-        # load the pictures from the custom path or from all picture sources
-        if self.custom_picturespath:
-            # load images from custom path
-            files = xbmcvfs.listdir(self.custom_picturespath)[1]
-            random.shuffle(files)
-            # pick max 20 images from path
-            for file in files[:20]:
-                if file.lower().endswith(".jpg") or file.lower().endswith(".png"):
-                    image = os.path.join(self.custom_picturespath, file.decode("utf-8"))
-                    images.append({"fanart": image, "title": file.decode("utf-8")})
+    def get_json(self, method, *args, **kwargs):
+        '''call the kodi json api and record the call time in the metrics'''
+        with self.stats.timer("jsonrpc.%s" % method):
+            return self.mutils.kodidb.get_json(method, *args, **kwargs)
+
+    def get_clean_image(self, image):
+        '''returns the normalized image url, memoized as the same urls come back on every refill'''
+        if not image:
+            return self.mutils.get_clean_image(image)
+        return self.clean_images.get_or_set(image, self.mutils.get_clean_image)
+
+    def get_image_from_media(self, media):
+        '''returns the image dict for the given media item, None if the item has no fanart'''
+        image = {}
+        if media.get('art'):
+            if media['art'].get('fanart'):
+                image["fanart"] = self.get_clean_image(media['art']['fanart'])
+            elif media['art'].get('tvshow.fanart'):
+                image["fanart"] = self.get_clean_image(media['art']['tvshow.fanart'])
+            elif media['art'].get('artist.fanart'):
+                image["fanart"] = self.get_clean_image(media['art']['artist.fanart'])
+            if media['art'].get('thumb'):
+                image["thumbnail"] = self.get_clean_image(media['art']['thumb'])
+        if not image.get('fanart') and media.get("fanart"):
+            image["fanart"] = self.get_clean_image(media['fanart'])
+        if not image.get("thumbnail") and media.get("thumbnail"):
+            image["thumbnail"] = self.get_clean_image(media["thumbnail"])
+        if not image.get("fanart"):
+            return None
+        # also append other art to the dict
+        image["title"] = media.get('title', '')
+        if not image.get("title"):
+            image["title"] = media.get('label', '')
+        image["landscape"] = self.get_clean_image(media.get('art', {}).get('landscape', ''))
+        image["poster"] = self.get_clean_image(media.get('art', {}).get('poster', ''))
+        image["clearlogo"] = self.get_clean_image(media.get('art', {}).get('clearlogo', ''))
+        return image
+
+    def get_pictures(self, count):
+        '''get images we can use as pictures background, sampled from the pictures index'''
+        return self.picturesindex.get_images(count)
+
+    def get_background_images(self, lib_path, count=None):
+        '''load the (max count) images for the given background source'''
+        count = count or self.prefetch_images
+        if lib_path == "pictures":
+            images = self.get_pictures(count)
+        elif lib_path == "pvr":
+            images = self.get_pvr_backgrounds()
+        elif lib_path.startswith(ARTINDEX_PATH):
+            images = self.artindex.get_images(lib_path, count)
         else:
-            # load pictures from all picture sources
-            media_array = self.mutils.kodidb.get_json('Files.GetSources', optparam=("media", "pictures"))
-            randomdirs = []
-            for source in media_array:
-                if 'file' in source:
-                    if "plugin://" not in source["file"]:
-                        dirs = xbmcvfs.listdir(source["file"])[0]
-                        random.shuffle(dirs)  # randomize output
-                        if dirs:
-                            # pick 10 subdirectories
-                            for randomdir in dirs[:10]:
-                                randomdir = os.path.join(source["file"], randomdir.decode("utf-8"))
-                                randomdirs.append(randomdir)
-                        # append root to dirs so we can also list images in the root
-                        randomdirs.append(source["file"])
-                        # pick 5 images from each dir
-                        for item in randomdirs:
-                            files2 = xbmcvfs.listdir(item)[1]
-                            random.shuffle(files2)
-                            for count, filename in enumerate(files2):
-                                if (filename.endswith(".jpg") or filename.endswith(".png")) and count < 6:
-                                    filename = filename.decode("utf-8")
-                                    image = os.path.join(item, filename)
-                                    images.append({"fanart": image, "title": filename})
+            images = self.get_images_from_vfspath(lib_path, count)
+        return images
+
+    def fetch_images(self, pool):
+        '''load the images for the pool from its source and record the fetch metrics'''
+        source = get_source_name(pool.win_prop)
+        count = self.get_prefetch_size(pool)
+        start = time.time()
+        images = self.get_background_images(pool.lib_path, count)
+        duration = time.time() - start
+        pool.record_fetch(count, len(images), duration)
+        self.stats.observe("fetch.%s" % source, duration * 1000)
+        self.stats.increment("items.%s" % source, len(images))
         return images
 
+    def get_prefetch_size(self, pool):
+        '''number of images to fetch for the pool, adapted to its consumption rate and fetch latency'''
+        if pool.lib_path and pool.lib_path.startswith(ARTINDEX_PATH) and 0 < pool.source_size <= MAX_PREFETCH:
+            # the art index knows the exact size of the source (e.g. the recently added items),
+            # fetch all of it so it is kept as a small source instead of walking the same top items
+            size = pool.source_size
+        elif not pool.consume_rate:
+            size = self.prefetch_images
+        else:
+            # enough images to last for the target time, slow sources get bigger batches so they are queried less
+            size = pool.consume_rate * PREFETCH_TARGET_TIME * (1 + min(pool.fetch_time / SLOW_FETCH_TIME, 3))
+            size = max(MIN_PREFETCH, min(MAX_PREFETCH, size))
+        # while the memory budget is exceeded all pools keep smaller batches
+        return max(1, int(size * self.memory_scale))
+
+    def fetch_background(self, pool):
+        '''executed by the fetch pool: load the images for a background and publish it right away'''
+        try:
+            self.set_background(pool.win_prop, pool.lib_path, label=pool.label)
+            self.propwriter.flush()
+        finally:
+            pool.fetch_busy = False
+
     def set_background(self, win_prop, lib_path, fallback_image="", label=None):
         '''set the window property for the background image'''
         if self.exit:
             return
         image = None
-        if win_prop in self.all_backgrounds2:
-            # pick one random image from the small list using normal random function
-            if len(self.all_backgrounds2[win_prop]) > 0:
-                image = random.choice(self.all_backgrounds2[win_prop])
-        elif win_prop in self.all_backgrounds and len(self.all_backgrounds[win_prop]) > 0:
-            # list is already in memory and still contains images, grab the next item in line
-            image = self.all_backgrounds[win_prop][0]
-            # delete image from list when we've used it so we have truly randomized images with minimized possibility of duplicates
-            del self.all_backgrounds[win_prop][0]
+        pool = self.pools.get_or_create(win_prop, lib_path, label)
+        if pool.loaded and pool.small:
+            # walk a shuffled order of the small list so images don't repeat before all were shown
+            images = pool.images
+            if images:
+                image = images[self.next_small_index(pool, len(images))]
+            self.stats.increment("pool.hits")
+        elif pool.loaded:
+            # list is already in memory, grab the next item in line (if any)
+            images = pool.images
+            if images:
+                image = images[0]
+                # delete image from list when we've used it so we have truly randomized images with minimized possibility of duplicates
+                del images[0]
+            # top up the list in the background before it runs empty so we never wait for the source here
+            if len(images) < max(1, (pool.prefetch or self.prefetch_images) * self.refill_watermark / 100):
+                self.refill_background(pool)
+            self.stats.increment("pool.hits" if image else "pool.empty")
         else:
             # no images in memory - load them from vfs
-            if lib_path == "pictures":
-                images = self.get_pictures()
-            elif lib_path == "pvr":
-                images = self.get_pvr_backgrounds()
-            else:
-                images = self.get_images_from_vfspath(lib_path)
+            images = self.fetch_images(pool)
+            self.stats.increment("pool.misses")
             # store images in memory
-            if (len(images) < self.prefetch_images):
-                # this path did not return enough images so we store it in a different list
-                # which will not be flushed
-                self.all_backgrounds2[win_prop] = images
+            self.store_background_images(pool, images)
+            images = pool.images
+            self.schedule_refresh(pool)
+            if pool.small:
                 if images:
-                    image = random.choice(images)
+                    image = images[self.next_small_index(pool, len(images))]
             else:
-                # normal approach: store the current set of images in a list
-                # images are taken from that list one-by-one untill it's empty
-                # once empty a fresh pair of images will be retrieved for the path
-                # this way we have fully randomized images while there's no need
-                # to store a big pile of data in memory
                 image = images[0]
                 del images[0]
-                self.all_backgrounds[win_prop] = images
             # also store the key + label in a list for skinshortcuts - only if the path actually has images
             if image:
-                self.save_background_label(win_prop, label)
+                self.save_background_label(pool, label)
+        if image:
+            pool.shown += 1
+            pool.last_shown = time.time()
+            self.prefetch_next_images(pool)
         # set the image
         self.set_image(win_prop, image, fallback_image)
 
+    def prefetch_next_images(self, pool):
+        '''download the next remote images of the pool and create the copies scaled to the screen resolution'''
+        images = pool.images
+        if not (self.imagecache.max_size or self.scaledcache.max_size) or not images:
+            return
+        if pool.small:
+            indexes = pool.cursor.peek(IMAGECACHE_PREFETCH) if pool.cursor else []
+            images = [images[index] for index in indexes if index < len(images)]
+        else:
+            images = images[:IMAGECACHE_PREFETCH]
+        urls = [image["fanart"] for image in images]
+        self.imagecache.prefetch(urls)
+        self.scaledcache.prefetch(urls)
+
+    def refill_background(self, pool, replace=False):
+        '''schedule a refill of the images list for the given pool (if not already busy)'''
+        if not pool.loaded or self.exit:
+            return
+        with self.refill_lock:
+            if pool.refill_busy:
+                if replace:
+                    # the running refill may have fetched the images before the source changed,
+                    # refresh the pool again once it is finished
+                    pool.refresh_pending = True
+                return
+            pool.refill_busy = True
+            pool.refresh_pending = False
+        if not self.refill_pool.submit(self.do_refill_background, pool, replace):
+            pool.refill_busy = False
+
+    def do_refill_background(self, pool, replace=False):
+        '''executed by the refill pool: fetch the next batch of images and append it to the list in memory'''
+        try:
+            images = self.fetch_images(pool)
+            self.stats.increment("pool.refreshes" if replace else "pool.refills")
+            if replace:
+                # refresh of the source: replace the images in memory with the fresh set
+                self.store_background_images(pool, images)
+            else:
+                pool.append(self.imagestore.make_records(images))
+        finally:
+            with self.refill_lock:
+                pool.refill_busy = False
+        if pool.refresh_pending:
+            self.refill_background(pool, True)
+
+    def store_background_images(self, pool, images):
+        '''store a fresh set of images for the given pool in memory'''
+        # a source which did not return enough images is kept in memory and cycled, it is only replaced
+        # when the source is refreshed. the images of the other sources are taken from the list one-by-one
+        # and refilled once it runs low, this way we have fully randomized images while there's no need
+        # to store a big pile of data in memory
+        count = pool.prefetch or self.prefetch_images
+        source_size = self.get_source_size(pool.lib_path, images, count)
+        small = len(images) < count
+        if pool.lib_path.startswith(ARTINDEX_PATH) and len(images) >= source_size:
+            # we got all items of the source with its exact size
+            small = True
+        pool.store(self.imagestore.make_records(images), small, source_size)
+
+    def check_memory_budget(self):
+        '''report the memory used by the images and shrink the batches of the pools while over budget'''
+        self.imagestore.prune(self.pools)
+        used, records = self.imagestore.get_memory(self.pools)
+        budget = self.memory_budget * 1024 * 1024
+        if budget and used > budget:
+            # lower the batch size of all pools, this also applies to their next fetches and refills
+            # so the pools stay within the budget instead of being evicted and fetched again
+            ratio = float(budget) / used
+            self.memory_scale = max(MIN_MEMORY_SCALE, self.memory_scale * ratio)
+            log_msg("Memory budget exceeded - the pools keep %d%% of their regular batches"
+                    % (self.memory_scale * 100))
+            for pool in self.pools:
+                if pool.images:
+                    self.trim_pool(pool, max(1, int(len(pool.images) * ratio)))
+            self.imagestore.prune(self.pools)
+            used, records = self.imagestore.get_memory(self.pools)
+        elif self.memory_scale < 1 and (not budget or used < budget * MEMORY_HEADROOM):
+            # there is room again, grow the batches step by step
+            self.memory_scale = min(1.0, self.memory_scale * 1.5) if budget else 1.0
+        log_msg("Images in memory: %s records in %s pools - %s KB (%s bytes per record)"
+                % (records, len([pool for pool in self.pools if pool.images]), used / 1024,
+                   used / records if records else 0))
+
+    @staticmethod
+    def trim_pool(pool, size):
+        '''drop the images of the pool above the given number, the pool is refilled from its source as usual'''
+        if len(pool.images) > size:
+            pool.images = pool.images[:size]
+            if pool.small:
+                # the pool no longer holds all images of its source, take them one-by-one and refill it
+                pool.small = False
+                pool.cursor = None
+
+    def get_source_size(self, lib_path, images, count):
+        '''returns the total number of items in the source, used to weigh the collections of the global backgrounds'''
+        if lib_path.startswith(ARTINDEX_PATH):
+            media_type, item_filter = self.artindex.parse_path(lib_path)
+            return self.artindex.count(media_type, item_filter)
+        if lib_path == "pictures":
+            return self.picturesindex.total
+        if len(images) < count or lib_path == "pvr":
+            # we have all images of the source in memory
+            return len(images)
+        content_path = get_content_path(lib_path)
+        if not content_path.lower().startswith(LIBRARY_PATHS):
+            # never list plugins (e.g. extendedinfo or the smart shortcut nodes) a second time just for a count,
+            # that would run the plugin again, the images we got are a lower bound for the weights
+            return len(images)
+        # ask the total number of items in the library directory
+        limits = self.get_json("Files.GetDirectory", returntype="limits",
+                               optparam=("directory", content_path), limits=(0, 1))
+        return max(len(images), limits.get("total", 0) if isinstance(limits, dict) else 0)
+
+    def schedule_refresh(self, pool):
+        '''schedule the periodic refresh of the images for the background source'''
+        job_name = "refresh.%s" % pool.win_prop
+        if not self.scheduler.has_job(job_name):
+            self.scheduler.add_job(job_name, partial(self.refresh_background, pool), self.get_refresh_interval(pool))
+
+    def refresh_background(self, pool):
+        '''scheduled refresh of the source images, postponed during fullscreen video or while the service is busy'''
+        if not self.gui_active():
+            return FULLSCREEN_RETRY_DELAY
+        if self.backoff > 1:
+            return BACKOFF_DELAY * self.backoff
+        self.refill_background(pool, True)
+        return self.get_refresh_interval(pool)
+
+    @staticmethod
+    def get_refresh_interval(pool):
+        '''returns the number of seconds between the refreshes of the source'''
+        interval = SOURCE_REFRESH_INTERVALS.get(pool.win_prop, SOURCE_REFRESH_DEFAULT)
+        if pool.small_streak >= LONG_TTL_STREAK:
+            # the source keeps returning less images than we ask for so all its images are in memory already
+            interval = max(interval, LONG_TTL_INTERVAL)
+        return interval
+
+    def on_library_changed(self, is_music, media_type="", walls=True, event="", item_id=None):
+        '''called by the kodi monitor: refresh the backgrounds and walls affected by a library change'''
+        if self.exit:
+            return
+        if not is_music:
+            # the movies and tvshows index is shared by multiple backgrounds so it is synced once
+            self.artindex.on_library_changed(event, media_type, item_id)
+        for pool in self.pools:
+            if pool.loaded and pool.lib_path and self.is_affected(pool.lib_path, is_music, media_type):
+                self.library_changes[pool.win_prop] = pool
+        if walls:
+            self.wallimages.invalidate_walls(
+                lambda lib_path: self.is_affected(lib_path, is_music, media_type))
+        if self.library_changes:
+            # library notifications come in bursts (e.g. during a scan), (re)start the timer for the refresh
+            self.scheduler.add_job("librarychanges", self.process_library_changes, 0, delay=LIBRARY_CHANGE_DELAY)
+
+    @staticmethod
+    def is_affected(lib_path, is_music, media_type=""):
+        '''check if the background for the given library path is affected by a library change'''
+        lib_path = lib_path.lower()
+        if is_music:
+            return lib_path.startswith("musicdb://") or "musicplaylists" in lib_path
+        if "videoplaylists" in lib_path:
+            return True
+        if not lib_path.startswith("videodb://") and not lib_path.startswith(ARTINDEX_PATH):
+            return False
+        if media_type in VIDEO_MEDIA_PATHS:
+            lib_path = lib_path.split("://", 1)[1].split("?")[0]
+            return lib_path.split("/")[0] in VIDEO_MEDIA_PATHS[media_type]
+        return True
+
+    def process_library_changes(self):
+        '''refresh the images of the backgrounds affected by the library changes'''
+        changes = self.library_changes
+        self.library_changes = {}
+        self.refill_pool.submit(self.do_process_library_changes, changes)
+
+    def do_process_library_changes(self, changes):
+        '''executed by the refill pool: sync the art index and refresh the affected backgrounds'''
+        self.artindex.sync_pending()
+        log_msg("Refreshing backgrounds after library change: %s" % changes.keys())
+        for pool in changes.itervalues():
+            self.refill_background(pool, True)
+
+    def next_small_index(self, pool, size):
+        '''returns the next index of the shuffled order of the small images list'''
+        if not pool.cursor:
+            pool.cursor = ShuffleCursor(size)
+        return pool.cursor.take(1, size)[0]
+
     def set_global_background(self, win_prop, keys, fallback_image="", label=None):
         '''get random background from random other collection'''
         image = None
-        # pick random category-key
-        random.shuffle(keys)
+        pool = self.pools.get_or_create(win_prop, label=label)
+        # pick a random category-key, weighted by the number of items in each collection
+        weights = []
         for key in keys:
-            if key in self.all_backgrounds2 and self.all_backgrounds2[key]:
-                # pick random image from this category
-                image = random.choice(self.all_backgrounds2[key])
-            elif key in self.all_backgrounds and self.all_backgrounds[key]:
-                # pick random image from this category
-                image = random.choice(self.all_backgrounds[key])
-            if image or self.exit:
-                break
+            collection = self.pools.get(key)
+            weights.append(collection.source_size if collection and collection.images else 0)
+        weights = tuple(weights)
+        sampler = pool.sampler
+        if not sampler or sampler.keys != tuple(keys) or sampler.weights != weights:
+            # only rebuild the alias table when the collections changed
+            sampler = AliasSampler(keys, weights)
+            pool.sampler = sampler
+        key = sampler.pick()
+        if key:
+            # pick random image from this category
+            image = random.choice(self.pools.get_images(key))
         # also store the win_prop + label in a list for skinshortcuts - only if the path actually has images
         if image:
-            self.save_background_label(win_prop, label)
+            pool.shown += 1
+            pool.last_shown = time.time()
+            self.save_background_label(pool, label)
         # set the image
         self.set_image(win_prop, image, fallback_image)
         return image
 
-    
     def set_image(self, win_prop, image, fallback_image):
         ''' actually set the image window property'''
         if image:
-            for key, value in image.iteritems():  # image is actually a dict
-                if key == "fanart":
-                    self.set_winprop(win_prop, value)
-                else:  # set additional image properties
-                    self.set_winprop("%s.%s" % (win_prop, key), value)
+            self.set_winprop(win_prop, self.get_display_image(image["fanart"]))
+            # set additional image properties, missing ones are cleared so no stale values are left behind
+            for key in IMAGE_KEYS:
+                self.set_winprop("%s.%s" % (win_prop, key), image.get(key, ""))
         elif fallback_image:
             # no image - use fallback_image
             self.set_winprop(win_prop, fallback_image)
+            for key in IMAGE_KEYS:
+                self.set_winprop("%s.%s" % (win_prop, key), "")
 
-    def save_background_label(self, win_prop, label):
+    def get_display_image(self, url):
+        '''returns the copy scaled to the screen resolution or the local copy of a remote image if available'''
+        return self.scaledcache.get_scaled(url) or self.imagecache.get_local(url)
+
+    def save_background_label(self, pool, label):
         ''' store background label in list, used for exachnge with other scripts'''
-        if not any(win_prop in item for item in self.all_backgrounds_labels):
+        if not pool.reported:
             if label and isinstance(label, int):
                 label = xbmc.getInfoLabel("$ADDON[%s %s]" % (ADDON_ID, label))
             elif not label:
-                label = win_prop
-            self.all_backgrounds_labels.append((win_prop, label))
+                label = pool.win_prop
+            self.pools.add_label(pool, label)
 
     def get_pvr_backgrounds(self):
         '''get the images for pvr items by using the skinhelper widgets as source'''
@@ -367,85 +776,87 @@ class BackgroundsUpdater(threading.Thread):
                 images += tv_images
         return images
 
-    def update_backgrounds(self):
-        '''update all our provided backgrounds'''
+    def get_backgrounds(self):
+        '''returns all backgrounds we provide as list of (win_prop, lib_path, label) tuples'''
+        backgrounds = []
 
-        # conditional background
-        self.win.setProperty("SkinHelper.ConditionalBackground", get_cond_background())
-
-        # movies backgrounds
+        # movies backgrounds, all derived from the shared movies index
         if xbmc.getCondVisibility("Library.HasContent(movies)"):
             # random/all movies
-            self.set_background("SkinHelper.AllMoviesBackground", "videodb://movies/titles/", label=32010)
+            backgrounds.append(("SkinHelper.AllMoviesBackground", ARTINDEX_PATH + "movies/all", 32010))
             # in progress movies
-            self.set_background(
-                "SkinHelper.InProgressMoviesBackground",
-                "videodb://movies/titles/?xsp=%s" %
-                urlencode(
-                    '{"limit":50,"order":{"direction":"ascending","method":"random"},'
-                    '"rules":{"and":[{"field":"inprogress","operator":"true","value":[]}]},"type":"movies"}'),
-                label=32012)
+            backgrounds.append(("SkinHelper.InProgressMoviesBackground", ARTINDEX_PATH + "movies/inprogress", 32012))
             # recent movies
-            self.set_background("SkinHelper.RecentMoviesBackground", "videodb://recentlyaddedmovies/", label=32011)
+            backgrounds.append(("SkinHelper.RecentMoviesBackground", ARTINDEX_PATH + "movies/recent", 32011))
             # unwatched movies
-            self.set_background(
-                "SkinHelper.UnwatchedMoviesBackground",
-                "videodb://movies/titles/?xsp=%s" %
-                urlencode(
-                    '{"limit":50,"order":{"direction":"ascending","method":"random"},'
-                    '"rules":{"and":[{"field":"playcount","operator":"is","value":0}]},"type":"movies"}'), label=32013)
-
-        # tvshows backgrounds
+            backgrounds.append(("SkinHelper.UnwatchedMoviesBackground", ARTINDEX_PATH + "movies/unwatched", 32013))
+
+        # tvshows backgrounds, the tvshows are derived from the shared tvshows index
         if xbmc.getCondVisibility("Library.HasContent(tvshows)"):
             # random/all tvshows
-            self.set_background("SkinHelper.AllTvShowsBackground", "videodb://tvshows/titles/", label=32014)
+            backgrounds.append(("SkinHelper.AllTvShowsBackground", ARTINDEX_PATH + "tvshows/all", 32014))
             # in progress tv shows
-            self.set_background(
-                "SkinHelper.InProgressShowsBackground",
-                "videodb://tvshows/titles/?xsp=%s" %
-                urlencode(
-                    '{"limit":50,"order":{"direction":"ascending","method":"random"},'
-                    '"rules":{"and":[{"field":"inprogress","operator":"true","value":[]}]},"type":"tvshows"}'),
-                label=32016)
+            backgrounds.append(("SkinHelper.InProgressShowsBackground", ARTINDEX_PATH + "tvshows/inprogress", 32016))
             # recent episodes
-            self.set_background("SkinHelper.RecentEpisodesBackground", "videodb://recentlyaddedepisodes/", label=32015)
+            backgrounds.append(("SkinHelper.RecentEpisodesBackground", "videodb://recentlyaddedepisodes/", 32015))
 
         # all musicvideos
         if xbmc.getCondVisibility("Library.HasContent(musicvideos)"):
-            self.set_background("SkinHelper.AllMusicVideosBackground", "videodb://musicvideos/titles", label=32018)
+            backgrounds.append(("SkinHelper.AllMusicVideosBackground", "videodb://musicvideos/titles", 32018))
 
         # all music
         if xbmc.getCondVisibility("Library.HasContent(music)"):
             # music artists
-            self.set_background("SkinHelper.AllMusicBackground", "musicdb://artists/", label=32019)
+            backgrounds.append(("SkinHelper.AllMusicBackground", "musicdb://artists/", 32019))
             # recent albums
-            self.set_background(
-                "SkinHelper.RecentMusicBackground", "musicdb://recentlyaddedalbums/", label=32023)
+            backgrounds.append(("SkinHelper.RecentMusicBackground", "musicdb://recentlyaddedalbums/", 32023))
             # random songs
-            self.set_background(
-                "SkinHelper.AllMusicSongsBackground", "musicdb://songs/", label=32022)
+            backgrounds.append(("SkinHelper.AllMusicSongsBackground", "musicdb://songs/", 32022))
 
         # tmdb backgrounds (extendedinfo)
         if xbmc.getCondVisibility("System.HasAddon(script.extendedinfo)"):
-            self.set_background(
-                "SkinHelper.TopRatedMovies",
-                "plugin://script.extendedinfo/?info=topratedmovies",
-                label=32020)
-            self.set_background(
-                "SkinHelper.TopRatedShows",
-                "plugin://script.extendedinfo/?info=topratedtvshows",
-                label=32021)
+            backgrounds.append(("SkinHelper.TopRatedMovies", "plugin://script.extendedinfo/?info=topratedmovies", 32020))
+            backgrounds.append(("SkinHelper.TopRatedShows", "plugin://script.extendedinfo/?info=topratedtvshows", 32021))
 
         # pictures background
-        self.set_background("SkinHelper.PicturesBackground", "pictures", label=32017)
+        backgrounds.append(("SkinHelper.PicturesBackground", "pictures", 32017))
 
         # pvr background
         if xbmc.getCondVisibility("PVR.HasTvChannels"):
-            self.set_background("SkinHelper.PvrBackground", "pvr", label=32024)
+            backgrounds.append(("SkinHelper.PvrBackground", "pvr", 32024))
 
         # smartshortcuts backgrounds
         for node in self.smartshortcuts.get_smartshortcuts_nodes():
-            self.set_background(node[0], node[1], label=node[2])
+            backgrounds.append((node[0], node[1], node[2]))
+
+        return backgrounds
+
+    def update_backgrounds(self):
+        '''update all our provided backgrounds'''
+
+        # conditional background
+        self.propwriter.set("SkinHelper.ConditionalBackground", get_cond_background())
+
+        # backgrounds which have images in memory are set directly,
+        # the others are fetched in parallel and published as soon as their images arrive
+        for win_prop, lib_path, label in self.get_backgrounds():
+            if self.exit:
+                return
+            pool = self.pools.get_or_create(win_prop, lib_path, label)
+            if pool.loaded:
+                self.set_background(win_prop, lib_path, label=label)
+            elif not pool.fetch_busy:
+                pool.fetch_busy = True
+                if not self.fetch_pool.submit(self.fetch_background, pool):
+                    pool.fetch_busy = False
+        self.propwriter.flush()
+
+        # the global backgrounds are built from the other collections so wait for the fetches to finish
+        if not self.fetch_pool.join(self.fetch_timeout):
+            log_msg("Fetching backgrounds did not finish within %s seconds, still busy: %s"
+                    % (self.fetch_timeout, [pool.win_prop for pool in self.pools if pool.fetch_busy]), xbmc.LOGWARNING)
+        if self.exit:
+            return
 
         # global backgrounds
         self.set_global_background("SkinHelper.GlobalFanartBackground",
@@ -464,3 +875,4 @@ class BackgroundsUpdater(threading.Thread):
         self.set_global_background(
             "SkinHelper.InProgressVideosBackground",
             ["SkinHelper.InProgressMoviesBackground", "SkinHelper.InProgressShowsBackground"], label=32028)
+        self.propwriter.flush()
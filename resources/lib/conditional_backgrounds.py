@@ -13,12 +13,15 @@ import xbmc
 import xbmcgui
 import xbmcvfs
 import xbmcaddon
-from datetime import datetime
+from datetime import datetime, date
 import time
+import json
+import ast
 
 CACHE_PATH = "special://profile/addon_data/script.skin.helper.backgrounds/"
 CACHE_FILE = CACHE_PATH + "conditionalbackgrounds.json"
 DATE_FORMAT = "%Y-%m-%d"
+MTIME_CHECK_INTERVAL = 60  # check the file for changes at most once in this amount of seconds
 
 
 class ConditionalBackgrounds(xbmcgui.WindowXMLDialog):
@@ -91,7 +94,7 @@ class ConditionalBackgrounds(xbmcgui.WindowXMLDialog):
             xbmcvfs.mkdir(CACHE_PATH)
         # write backgrounds to file
         text_file = xbmcvfs.File(CACHE_FILE, "w")
-        text_file.write(repr(self.all_backgrounds))
+        text_file.write(json.dumps(self.all_backgrounds))
         text_file.close()
         self.close()
 
@@ -186,17 +189,70 @@ class ConditionalBackgrounds(xbmcgui.WindowXMLDialog):
 # GLOBAL HELPERS - ALSO ACCESSED BY BACKGROUNDS UPDATER SERVICE
 
 
+class ConditionalSchedule():
+    '''compiled schedule of the conditional backgrounds, only reloaded when the file is changed'''
+
+    def __init__(self):
+        self.mtime = None
+        self.last_check = 0
+        self.intervals = []  # sorted list of (start, end, priority, background)
+        self.active_date = None
+        self.active_background = ""
+
+    def get_background(self):
+        '''returns the active conditional background, only recomputed at midnight or when the file changed'''
+        now = time.time()
+        if now - self.last_check > MTIME_CHECK_INTERVAL:
+            self.last_check = now
+            mtime = get_mtime(CACHE_FILE)
+            if mtime != self.mtime:
+                self.mtime = mtime
+                self.compile(get_cond_backgrounds())
+                self.active_date = None
+        today = date.today()
+        if today != self.active_date:
+            self.active_date = today
+            self.active_background = self.get_active(today.strftime(DATE_FORMAT))
+        return self.active_background
+
+    def compile(self, all_backgrounds):
+        '''parse the backgrounds into intervals sorted by startdate'''
+        intervals = []
+        for priority, item in enumerate(all_backgrounds):
+            if item["startdate"] <= item["enddate"]:
+                intervals.append((item["startdate"], item["enddate"], priority, item["background"]))
+            else:
+                # interval wraps (e.g. the year end): split it in an open ended and an open started part
+                intervals.append((item["startdate"], "9999-12-31", priority, item["background"]))
+                intervals.append(("0000-01-01", item["enddate"], priority, item["background"]))
+        self.intervals = sorted(intervals)
+        log_msg("Conditional backgrounds loaded: %s rules" % len(all_backgrounds))
+
+    def get_active(self, date_today):
+        '''returns the background of the first rule (in the order of the file) which is active on the given date'''
+        active = None
+        for start, end, priority, background in self.intervals:
+            if start > date_today:
+                # sorted by startdate so no further matches possible
+                break
+            if date_today <= end and (not active or priority < active[0]):
+                active = (priority, background)
+        return active[1] if active else ""
+
+
+SCHEDULE = ConditionalSchedule()
+
+
 def get_cond_background():
     '''get the current active conditional background (if any) - called by the background service'''
-    background = ""
-    all_cond_backgrounds = get_cond_backgrounds()
-    if all_cond_backgrounds:
-        date_today = datetime.now().strftime(DATE_FORMAT)
-        for item in all_cond_backgrounds:
-            if time_in_range(item["startdate"], item["enddate"], date_today):
-                background = item["background"]
-                break
-    return background
+    return SCHEDULE.get_background()
+
+
+def get_mtime(filename):
+    '''returns the modification time of the file or None if it doesn't exist'''
+    if xbmcvfs.exists(filename):
+        return xbmcvfs.Stat(filename).st_mtime()
+    return None
 
 
 def get_cond_backgrounds():
@@ -206,7 +262,11 @@ def get_cond_backgrounds():
         text_file = xbmcvfs.File(CACHE_FILE)
         try:
             text = text_file.read()
-            all_backgrounds = eval(text)
+            try:
+                all_backgrounds = json.loads(text)
+            except ValueError:
+                # file written by an older version (python repr)
+                all_backgrounds = ast.literal_eval(text)
         except Exception as exc:
             log_exception(__name__, exc)
         finally:
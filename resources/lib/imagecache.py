@@ -0,0 +1,274 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+    Local disk caches for the background images in the addon_data folder.
+    ImageCache downloads the next remote (http) images of each background so the skin can show the local copy
+    when the background rotates instead of waiting for the network.
+    ScaledImageCache stores copies of the next (big) images scaled to the screen resolution so the GUI doesn't
+    have to decode and scale a full size (e.g. 4K) image on every rotation.
+    Both caches are capped in size, the least recently used images are removed first.
+'''
+
+import hashlib
+import io
+import os
+import threading
+import urllib2
+import urlparse
+from collections import OrderedDict
+from utils import log_msg, log_exception
+from workerpool import WorkerPool
+import xbmc
+import xbmcvfs
+
+ADDON_DATA = "special://profile/addon_data/script.skin.helper.backgrounds/"
+DOWNLOAD_TIMEOUT = 20
+USER_AGENT = "Kodi script.skin.helper.backgrounds"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+SCALED_QUALITY = 90
+DEFAULT_SCREEN_SIZE = (1920, 1080)
+
+# IMPORT PIL/PILLOW ###################################
+SUPPORTS_PIL = False
+
+try:
+    # prefer Pillow
+    from PIL import Image
+    SUPPORTS_PIL = True
+except Exception:
+    try:
+        # fallback to traditional PIL
+        import Image
+        SUPPORTS_PIL = True
+    except Exception:
+        pass
+
+
+def is_remote(url):
+    '''check if the image is loaded over http'''
+    return url.startswith("http://") or url.startswith("https://")
+
+
+def get_cache_filename(url, suffix=""):
+    '''returns the filename of the url in the cache'''
+    if isinstance(url, unicode):
+        url = url.encode("utf-8")
+    extension = os.path.splitext(urlparse.urlparse(url.split("|")[0]).path)[1].lower()
+    if suffix or extension not in IMAGE_EXTENSIONS:
+        extension = ".jpg"
+    return hashlib.md5(url + suffix).hexdigest() + extension
+
+
+class DiskCache(object):
+    '''Size capped LRU cache of image files in a folder of the addon_data'''
+
+    def __init__(self, bgupdater, name, num_workers):
+        self.bgupdater = bgupdater
+        self.name = name
+        self.path = ADDON_DATA + name + "/"
+        self.local_path = xbmc.translatePath(self.path).decode("utf-8")
+        self.lock = threading.Lock()
+        self.max_size = 0  # in bytes, 0 disables the cache
+        self.loaded = False
+        self.total_size = 0
+        self.entries = OrderedDict()  # filename --> size, least recently used first
+        self.busy = set()  # filenames which are being created
+        self.pool = WorkerPool(num_workers, name="SkinHelperBackgrounds.%s" % name)
+
+    def stop(self):
+        '''stop the workers'''
+        self.pool.stop()
+
+    def load(self):
+        '''build the index of the cached images, the oldest files are evicted first'''
+        self.loaded = True
+        if not xbmcvfs.exists(self.path):
+            xbmcvfs.mkdirs(self.path)
+            return
+        files = []
+        for filename in xbmcvfs.listdir(self.path)[1]:
+            filename = filename.decode("utf-8")
+            if filename.endswith(".tmp"):
+                xbmcvfs.delete(self.path + filename)
+                continue
+            stat = xbmcvfs.Stat(self.path + filename)
+            files.append((stat.st_mtime(), filename, stat.st_size()))
+        with self.lock:
+            for _, filename, size in sorted(files):
+                self.entries[filename] = size
+                self.total_size += size
+        log_msg("%s - %s images cached (%s KB)" % (self.name, len(self.entries), self.total_size / 1024))
+
+    def lookup(self, filename):
+        '''returns the local path of the cached file (marked as most recently used) or None'''
+        with self.lock:
+            size = self.entries.pop(filename, None)
+            if size is None:
+                return None
+            self.entries[filename] = size
+        return os.path.join(self.local_path, filename)
+
+    def submit(self, filename, func, *args):
+        '''create the file in the background (if not cached or busy already)'''
+        if not self.loaded:
+            self.load()
+        with self.lock:
+            if filename in self.entries or filename in self.busy:
+                return
+            self.busy.add(filename)
+        if not self.pool.submit(self.create, filename, func, *args):
+            self.busy.discard(filename)
+
+    def create(self, filename, func, *args):
+        '''executed by the workers: func returns the data of the file to store in the cache'''
+        try:
+            data = func(*args)
+            if not data or self.bgupdater.exit:
+                return
+            # write to a temporary file first so the skin never sees a partial image
+            tmp_file = self.path + filename + ".tmp"
+            cache_file = xbmcvfs.File(tmp_file, "w")
+            try:
+                cache_file.write(data)
+            finally:
+                cache_file.close()
+            xbmcvfs.rename(tmp_file, self.path + filename)
+            with self.lock:
+                self.entries[filename] = len(data)
+                self.total_size += len(data)
+            self.bgupdater.stats.increment("%s.created" % self.name)
+            self.bgupdater.stats.increment("%s.bytes" % self.name, len(data))
+            self.evict()
+        except Exception as exc:
+            self.bgupdater.stats.increment("%s.failed" % self.name)
+            log_msg("%s - creating %s failed: %s" % (self.name, filename, exc), xbmc.LOGWARNING)
+        finally:
+            self.busy.discard(filename)
+
+    def evict(self):
+        '''remove the least recently used images until the cache fits in its max size'''
+        removed = []
+        with self.lock:
+            while self.entries and self.total_size > self.max_size:
+                filename, size = self.entries.popitem(last=False)
+                self.total_size -= size
+                removed.append(filename)
+        for filename in removed:
+            try:
+                xbmcvfs.delete(self.path + filename)
+            except Exception as exc:
+                log_exception(__name__, exc)
+
+
+class ImageCache(DiskCache):
+    '''Local copies of remote images'''
+
+    def __init__(self, bgupdater):
+        super(ImageCache, self).__init__(bgupdater, "imagecache", 2)
+
+    def get_cached(self, url):
+        '''returns the path of the local copy of the image or None'''
+        if not self.max_size or not url or not is_remote(url):
+            return None
+        return self.lookup(get_cache_filename(url))
+
+    def get_local(self, url):
+        '''returns the path of the local copy of the image or the url itself if it is not cached'''
+        if not self.max_size or not url or not is_remote(url):
+            return url
+        local_path = self.get_cached(url)
+        self.bgupdater.stats.increment("imagecache.hits" if local_path else "imagecache.misses")
+        return local_path or url
+
+    def prefetch(self, urls):
+        '''download the remote images which are not cached yet in the background'''
+        if not self.max_size or self.bgupdater.exit:
+            return
+        for url in urls:
+            if url and is_remote(url):
+                self.submit(get_cache_filename(url), self.download, url)
+
+    @staticmethod
+    def download(url):
+        '''returns the data of the remote image'''
+        # kodi urls may contain the http headers after a pipe: url|User-Agent=xxx&Referer=yyy
+        url, _, headers = url.partition("|")
+        headers = dict(urlparse.parse_qsl(headers))
+        headers.setdefault("User-Agent", USER_AGENT)
+        if isinstance(url, unicode):
+            url = url.encode("utf-8")
+        response = urllib2.urlopen(urllib2.Request(url, headers=headers), timeout=DOWNLOAD_TIMEOUT)
+        try:
+            return response.read()
+        finally:
+            response.close()
+
+
+class ScaledImageCache(DiskCache):
+    '''Copies of the images scaled down to the screen resolution'''
+
+    def __init__(self, bgupdater):
+        super(ScaledImageCache, self).__init__(bgupdater, "scaledimages", 1)
+        self.unscaled = set()  # images which are small enough already or could not be scaled
+        self.screen_size = DEFAULT_SCREEN_SIZE
+
+    def update_screen_size(self):
+        '''read the resolution of the screen, not on every lookup as the infolabels need the GUI lock'''
+        try:
+            self.screen_size = (int(xbmc.getInfoLabel("System.ScreenWidth")),
+                                int(xbmc.getInfoLabel("System.ScreenHeight")))
+        except ValueError:
+            self.screen_size = DEFAULT_SCREEN_SIZE
+
+    def get_filename(self, url):
+        '''the filename of the scaled copy includes the screen size so a resolution change creates new copies'''
+        return get_cache_filename(url, "@%sx%s" % self.screen_size)
+
+    def get_scaled(self, url):
+        '''returns the path of the scaled copy of the image or None'''
+        if not self.max_size or not url or not SUPPORTS_PIL or url in self.unscaled:
+            return None
+        local_path = self.lookup(self.get_filename(url))
+        self.bgupdater.stats.increment("scaledimages.hits" if local_path else "scaledimages.misses")
+        return local_path
+
+    def prefetch(self, urls):
+        '''create the scaled copies of the images in the background'''
+        if not self.max_size or not SUPPORTS_PIL or self.bgupdater.exit:
+            return
+        size = self.screen_size
+        for url in urls:
+            if not url or url in self.unscaled:
+                continue
+            source = url
+            if is_remote(url):
+                # remote images are scaled once they are in the local image cache
+                source = self.bgupdater.imagecache.get_cached(url)
+                if not source:
+                    continue
+            self.submit(self.get_filename(url), self.scale, url, source, size)
+
+    def scale(self, url, source, size):
+        '''returns the jpeg data of the image scaled to fit the screen, None if no scaling is needed'''
+        image_file = xbmcvfs.File(source)
+        try:
+            data = image_file.readBytes()
+        finally:
+            image_file.close()
+        try:
+            img = Image.open(io.BytesIO(bytearray(data)))
+            if img.size[0] <= size[0] and img.size[1] <= size[1]:
+                # small enough already, the original is used
+                self.unscaled.add(url)
+                return None
+            # let the jpeg decoder do most of the downscaling
+            img.draft("RGB", size)
+            img = img.convert("RGB")
+            img.thumbnail(size, Image.ANTIALIAS)
+            output = io.BytesIO()
+            img.save(output, "JPEG", quality=SCALED_QUALITY)
+            return output.getvalue()
+        except Exception:
+            self.unscaled.add(url)
+            raise
@@ -0,0 +1,49 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+    Kodi monitor for the backgrounds service.
+    Listens for library notifications so only the backgrounds and walls affected by a library change are refreshed.
+'''
+
+import json
+import xbmc
+from utils import log_msg, log_exception
+
+LIBRARY_EVENTS = ("OnScanFinished", "OnCleanFinished", "OnUpdate", "OnRemove")
+
+
+class KodiMonitor(xbmc.Monitor):
+    '''Monitor which forwards library changes to the backgrounds service'''
+    bgupdater = None
+
+    def __init__(self, *args, **kwargs):
+        xbmc.Monitor.__init__(self)
+
+    def onNotification(self, sender, method, data):
+        '''builtin function for the xbmc.Monitor class'''
+        try:
+            library, event = method.split(".", 1)
+            if library in ("VideoLibrary", "AudioLibrary") and event in LIBRARY_EVENTS and self.bgupdater:
+                media_type, item_id, added = self.parse_notification_data(data)
+                log_msg("Library change detected: %s - media type: %s - id: %s" % (method, media_type, item_id))
+                # a new item or a (finished) scan/clean also changes the walls, playcount updates do not
+                walls = event != "OnUpdate" or added
+                self.bgupdater.on_library_changed(library == "AudioLibrary", media_type, walls, event, item_id)
+        except Exception as exc:
+            log_exception(__name__, exc)
+
+    @staticmethod
+    def parse_notification_data(data):
+        '''returns the media type and id of the changed item (if any) and if the item was newly added'''
+        media_type = ""
+        item_id = None
+        added = False
+        if data:
+            data = json.loads(data)
+            if isinstance(data, dict):
+                item = data.get("item", data)
+                media_type = item.get("type", "")
+                item_id = item.get("id")
+                added = data.get("added", False)
+        return media_type, item_id, added
@@ -0,0 +1,160 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+    Persisted index of the images in the picture sources (or the custom pictures path).
+    A background crawler updates the index incrementally: directories are only listed again when their
+    modification time changed. Random pictures are sampled uniformly across all indexed images
+    from memory so refilling the pictures background costs no filesystem I/O.
+'''
+
+import bisect
+import json
+import threading
+from utils import log_msg, log_exception
+from sampling import PermutationCursor
+import xbmcvfs
+
+INDEX_PATH = "special://profile/addon_data/script.skin.helper.backgrounds/"
+INDEX_FILE = INDEX_PATH + "picturesindex.json"
+INDEX_VERSION = 1
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def join_path(path, name):
+    '''join a (vfs) directory path and a name'''
+    if not path.endswith("/") and not path.endswith("\\"):
+        path += "/"
+    return path + name
+
+
+class PicturesIndex():
+    '''Index of all images in the pictures sources, crawled incrementally in the background'''
+
+    def __init__(self, bgupdater):
+        self.bgupdater = bgupdater
+        self.lock = threading.Lock()
+        self.crawl_busy = False
+        self.loaded = False
+        self.roots_key = None  # custom path or all sources, the index is rebuilt when changed
+        self.dirs = {}  # directory --> [mtime, [image files], [subdirectories]]
+        self.dir_list = []  # directories with images
+        self.cumulative_counts = []  # cumulative number of images for dir_list, used for uniform sampling
+        self.total = 0
+        self.cursor = PermutationCursor(0)
+
+    def get_images(self, count):
+        '''returns the next (max count) images of a random permutation of all indexed images'''
+        if not self.loaded:
+            self.load()
+        if not self.total or self.roots_key != self.get_roots_key():
+            # no (usable) index yet, we have to crawl right now
+            self.crawl()
+        images = []
+        with self.lock:
+            if self.total:
+                for index in self.cursor.take(count, self.total):
+                    dir_index = bisect.bisect_right(self.cumulative_counts, index)
+                    directory = self.dir_list[dir_index]
+                    offset = index - (self.cumulative_counts[dir_index - 1] if dir_index else 0)
+                    filename = self.dirs[directory][1][offset]
+                    images.append({"fanart": join_path(directory, filename), "title": filename})
+        return images
+
+    def get_roots_key(self):
+        '''the index is built for the custom pictures path or for all picture sources'''
+        return self.bgupdater.custom_picturespath or "sources"
+
+    def get_roots(self):
+        '''returns the root directories to crawl'''
+        if self.bgupdater.custom_picturespath:
+            return [self.bgupdater.custom_picturespath]
+        roots = []
+        media_array = self.bgupdater.get_json('Files.GetSources', optparam=("media", "pictures"))
+        for source in media_array:
+            if 'file' in source and "plugin://" not in source["file"]:
+                roots.append(source["file"])
+        return roots
+
+    def schedule_crawl(self):
+        '''update the index in the background'''
+        if not self.crawl_busy:
+            self.bgupdater.refill_pool.submit(self.crawl)
+
+    def crawl(self):
+        '''update the index: only directories with a changed modification time are listed again'''
+        if self.crawl_busy:
+            return
+        self.crawl_busy = True
+        try:
+            roots_key = self.get_roots_key()
+            max_depth = self.bgupdater.pictures_depth
+            old_dirs = self.dirs if roots_key == self.roots_key else {}
+            new_dirs = {}
+            listed = 0
+            pending = [(root, 0) for root in self.get_roots()]
+            while pending and not self.bgupdater.exit:
+                directory, depth = pending.pop()
+                mtime = xbmcvfs.Stat(directory).st_mtime()
+                entry = old_dirs.get(directory)
+                if not entry or entry[0] != mtime:
+                    dirs, files = xbmcvfs.listdir(directory)
+                    files = [item.decode("utf-8") for item in files if item.lower().endswith(IMAGE_EXTENSIONS)]
+                    entry = [mtime, files, [item.decode("utf-8") for item in dirs]]
+                    listed += 1
+                new_dirs[directory] = entry
+                if depth < max_depth:
+                    # the mtime of a directory doesn't change for changes in its subdirectories so visit them all
+                    for subdir in entry[2]:
+                        pending.append((join_path(directory, subdir), depth + 1))
+            if self.bgupdater.exit:
+                return
+            self.set_index(roots_key, new_dirs)
+            log_msg("PicturesIndex - %s images in %s directories (%s listed)" % (self.total, len(new_dirs), listed))
+            if listed:
+                self.save()
+        except Exception as exc:
+            log_exception(__name__, exc)
+        finally:
+            self.crawl_busy = False
+
+    def set_index(self, roots_key, dirs):
+        '''activate the (new) index and build the lookup lists for sampling'''
+        dir_list = []
+        cumulative_counts = []
+        total = 0
+        for directory, entry in dirs.iteritems():
+            if entry[1]:
+                total += len(entry[1])
+                dir_list.append(directory)
+                cumulative_counts.append(total)
+        with self.lock:
+            self.roots_key = roots_key
+            self.dirs = dirs
+            self.dir_list = dir_list
+            self.cumulative_counts = cumulative_counts
+            self.total = total
+
+    def load(self):
+        '''load the index from disk'''
+        self.loaded = True
+        if xbmcvfs.exists(INDEX_FILE):
+            index_file = xbmcvfs.File(INDEX_FILE)
+            try:
+                data = json.loads(index_file.read())
+                if data.get("version") == INDEX_VERSION:
+                    self.set_index(data["roots"], data["dirs"])
+            except Exception as exc:
+                log_exception(__name__, exc)
+            finally:
+                index_file.close()
+
+    def save(self):
+        '''save the index to disk'''
+        if not xbmcvfs.exists(INDEX_PATH):
+            xbmcvfs.mkdirs(INDEX_PATH)
+        index_file = xbmcvfs.File(INDEX_FILE, "w")
+        try:
+            index_file.write(json.dumps({"version": INDEX_VERSION, "roots": self.roots_key, "dirs": self.dirs}))
+        finally:
+            index_file.close()
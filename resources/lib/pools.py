@@ -0,0 +1,162 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+    Registry of the background pools.
+    Each background (window property) has one pool holding its source, the images in memory
+    and the refill bookkeeping. The registry is owned by the backgrounds updater instance and shared
+    by the rotation, the walls and the smart shortcuts so there is one index with O(1) lookups.
+'''
+
+import threading
+import time
+
+
+class BackgroundPool(object):
+    '''State of a single background: its source, the images in memory and some stats'''
+    __slots__ = ("win_prop", "lib_path", "label", "images", "small", "cursor", "source_size", "sampler",
+                 "wall_limit", "reported", "fetch_busy", "refill_busy", "refresh_pending", "created",
+                 "last_fetch", "last_refill", "last_shown", "shown", "fetches", "refills", "prefetch",
+                 "fetch_time", "consume_rate", "rate_shown", "rate_time", "small_streak")
+
+    def __init__(self, win_prop, lib_path=None, label=None):
+        self.win_prop = win_prop
+        self.lib_path = lib_path  # None for the global backgrounds which are built from other pools
+        self.label = label
+        self.images = None  # None as long as the images were not loaded from the source
+        self.small = False  # the source has less images than we prefetch so the list is kept and cycled
+        self.cursor = None  # ShuffleCursor for the small images list
+        self.source_size = 0  # total number of items in the source
+        self.sampler = None  # AliasSampler over the collections of a global background
+        self.wall_limit = 0  # number of images of the manual wall, 0 if disabled
+        self.reported = False  # the label is in the list of all backgrounds for skinshortcuts
+        self.fetch_busy = False
+        self.refill_busy = False
+        self.refresh_pending = False  # a refresh was requested while a refill was running
+        self.created = time.time()
+        self.last_fetch = 0
+        self.last_refill = 0
+        self.last_shown = 0
+        self.shown = 0
+        self.fetches = 0
+        self.refills = 0
+        self.prefetch = 0  # number of images requested by the last fetch
+        self.fetch_time = 0.0  # average fetch duration in seconds
+        self.consume_rate = 0.0  # average number of images shown per second
+        self.rate_shown = 0
+        self.rate_time = 0
+        self.small_streak = 0  # number of fetches in a row which returned less images than requested
+
+    @property
+    def loaded(self):
+        '''check if the images of the source are in memory (the list may be empty)'''
+        return self.images is not None
+
+    def store(self, images, small, source_size):
+        '''store a fresh set of images for this pool'''
+        self.images = images
+        self.small = small
+        self.source_size = source_size
+        self.last_fetch = time.time()
+        self.fetches += 1
+
+    def append(self, images):
+        '''add the images of a refill, skipping the ones which are already in the pool'''
+        current = self.images or []
+        known = set(item["fanart"] for item in current)
+        current += [item for item in images if item["fanart"] not in known]
+        self.images = current
+        self.last_refill = time.time()
+        self.refills += 1
+
+    def record_fetch(self, requested, returned, duration):
+        '''update the measured fetch latency, consumption rate and small source streak after a fetch'''
+        now = time.time()
+        self.fetch_time = duration if not self.fetch_time else self.fetch_time * 0.7 + duration * 0.3
+        if self.rate_time and self.shown > self.rate_shown:
+            rate = (self.shown - self.rate_shown) / max(1.0, now - self.rate_time)
+            self.consume_rate = rate if not self.consume_rate else self.consume_rate * 0.7 + rate * 0.3
+        self.rate_shown = self.shown
+        self.rate_time = now
+        self.small_streak = self.small_streak + 1 if returned < requested else 0
+        self.prefetch = requested
+
+    def get_stats(self):
+        '''returns a dict with the stats of this pool'''
+        return {
+            "images": len(self.images or []),
+            "small": self.small,
+            "source_size": self.source_size,
+            "shown": self.shown,
+            "fetches": self.fetches,
+            "refills": self.refills,
+            "prefetch": self.prefetch,
+            "fetch_time": round(self.fetch_time, 3),
+            "consume_rate": round(self.consume_rate, 4),
+            "small_streak": self.small_streak,
+            "last_fetch": self.last_fetch,
+            "last_refill": self.last_refill,
+            "last_shown": self.last_shown
+        }
+
+
+class PoolRegistry(object):
+    '''All background pools by window property'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pools = {}  # win_prop --> BackgroundPool
+        self.labels = []  # (win_prop, label) of the backgrounds with images, in order of appearance
+
+    def __contains__(self, win_prop):
+        return win_prop in self.pools
+
+    def __len__(self):
+        return len(self.pools)
+
+    def __iter__(self):
+        '''iterate over a snapshot of the pools so the registry may change meanwhile'''
+        return iter(self.pools.values())
+
+    def get(self, win_prop):
+        '''returns the pool for the given window property or None'''
+        return self.pools.get(win_prop)
+
+    def get_or_create(self, win_prop, lib_path=None, label=None):
+        '''returns the pool for the given window property, created if it doesn't exist yet'''
+        pool = self.pools.get(win_prop)
+        if not pool:
+            with self.lock:
+                pool = self.pools.get(win_prop)
+                if not pool:
+                    pool = BackgroundPool(win_prop, lib_path, label)
+                    self.pools[win_prop] = pool
+        if lib_path and pool.lib_path != lib_path:
+            # the source of the background changed (e.g. a smart shortcut node), drop the old images
+            pool.lib_path = lib_path
+            pool.images = None
+            pool.cursor = None
+        if label and not pool.label:
+            pool.label = label
+        return pool
+
+    def get_images(self, win_prop):
+        '''returns the images which are currently in memory for the given window property'''
+        pool = self.pools.get(win_prop)
+        return (pool.images or []) if pool else []
+
+    def add_label(self, pool, label):
+        '''add the label of the pool to the list of all backgrounds (once)'''
+        if not pool.reported:
+            pool.reported = True
+            self.labels.append((pool.win_prop, label))
+
+    def get_stats(self):
+        '''returns the stats of all pools with images in memory'''
+        return dict((pool.win_prop, pool.get_stats()) for pool in self if pool.loaded)
+
+    def clear(self):
+        '''drop all pools'''
+        with self.lock:
+            self.pools = {}
+            self.labels = []
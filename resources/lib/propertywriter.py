@@ -0,0 +1,64 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+    Diff-aware writer for the window properties we provide to the skin.
+    Every call to Window.setProperty takes the GUI lock so changes are collected
+    and only the values which actually changed are written in one flush.
+'''
+
+import threading
+
+
+class PropertyWriter():
+    '''Collects window property changes and writes only the changed values in batches'''
+
+    def __init__(self, win):
+        self.win = win
+        self.lock = threading.RLock()
+        self.published = {}  # last value written to the window for each key
+        self.pending = {}
+        self.writes = 0
+        self.skipped = 0
+
+    def set(self, key, value):
+        '''stage a new value for the window property, an empty value clears the property'''
+        if isinstance(key, unicode):
+            key = key.encode("utf-8")
+        if isinstance(value, unicode):
+            value = value.encode("utf-8")
+        with self.lock:
+            if key in self.pending:
+                # overwritten within the same batch
+                self.skipped += 1
+            self.pending[key] = value or ""
+
+    def clear(self, key):
+        '''stage clearing of the window property'''
+        self.set(key, "")
+
+    def flush(self):
+        '''write all staged changes to the window, unchanged values are skipped'''
+        with self.lock:
+            if not self.pending:
+                return 0
+            pending = self.pending
+            self.pending = {}
+            count = 0
+            for key, value in pending.iteritems():
+                if self.published.get(key, "") == value:
+                    self.skipped += 1
+                    continue
+                if value:
+                    self.win.setProperty(key, value)
+                    self.published[key] = value
+                else:
+                    self.win.clearProperty(key)
+                    self.published.pop(key, None)
+                count += 1
+            self.writes += count
+            return count
+
+    def get_stats(self):
+        '''returns a tuple with the number of written and skipped property writes'''
+        return self.writes, self.skipped
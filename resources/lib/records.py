@@ -0,0 +1,97 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+    Compact storage of the images in memory.
+    Every image of a background pool is stored as a slots based ImageRecord instead of a dict and all
+    values (mostly long image urls) are interned in one table shared by all pools, so an image which is
+    in multiple pools (e.g. all movies and unwatched movies) only stores its urls once.
+'''
+
+import sys
+import threading
+
+RECORD_KEYS = ("fanart", "title", "landscape", "poster", "clearlogo", "thumbnail")
+
+
+class ImageRecord(object):
+    '''A single image of a background with its additional art, read-only dict-like access for compatibility'''
+    __slots__ = RECORD_KEYS
+
+    def __init__(self, image, intern_value=None):
+        for key in RECORD_KEYS:
+            value = image.get(key)
+            if intern_value and value:
+                value = intern_value(value)
+            setattr(self, key, value)
+
+    def __getitem__(self, key):
+        value = getattr(self, key, None) if key in RECORD_KEYS else None
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return key in RECORD_KEYS and getattr(self, key) is not None
+
+    def get(self, key, default=None):
+        '''same as dict.get'''
+        value = getattr(self, key, None) if key in RECORD_KEYS else None
+        return default if value is None else value
+
+    def iteritems(self):
+        '''same as dict.iteritems'''
+        for key in RECORD_KEYS:
+            value = getattr(self, key)
+            if value is not None:
+                yield key, value
+
+    def values(self):
+        '''same as dict.values'''
+        return [value for _, value in self.iteritems()]
+
+
+class ImageStore(object):
+    '''Creates the image records and holds the table with the interned values shared by all pools'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.strings = {}
+
+    def intern_value(self, value):
+        '''returns the shared instance of the given value'''
+        return self.strings.setdefault(value, value)
+
+    def make_records(self, images):
+        '''convert the image dicts of a source to records'''
+        return [image if isinstance(image, ImageRecord) else ImageRecord(image, self.intern_value)
+                for image in images]
+
+    def prune(self, pools):
+        '''drop the values which are no longer used by any pool from the table'''
+        live = {}
+        for pool in pools:
+            for record in pool.images or []:
+                for value in record.values():
+                    live[value] = value
+        with self.lock:
+            self.strings = live
+
+    @staticmethod
+    def get_pool_memory(images):
+        '''returns the (estimated) number of bytes used by the list and records of a pool, values excluded'''
+        if not images:
+            return 0
+        return sys.getsizeof(images) + len(images) * sys.getsizeof(images[0])
+
+    def get_memory(self, pools):
+        '''returns the (estimated) number of bytes used by all images in memory and the number of records'''
+        records = 0
+        used = 0
+        for pool in pools:
+            if pool.images:
+                records += len(pool.images)
+                used += self.get_pool_memory(pool.images)
+        strings = self.strings
+        used += sys.getsizeof(strings) + sum(sys.getsizeof(value) for value in strings)
+        return used, records
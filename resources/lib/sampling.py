@@ -0,0 +1,152 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+    Helpers for picking random backgrounds.
+    PermutationCursor walks a pseudorandom permutation of all items of a source so every item is shown
+    once before any item repeats, using constant memory no matter how big the library is.
+    ShuffleCursor does the same for the small lists in memory with a real shuffle per pass.
+    AliasSampler picks a weighted random key in constant time, used for the global backgrounds.
+'''
+
+import random
+
+
+class PermutationCursor(object):
+    '''Cursor over a pseudorandom permutation of range(size): a full period LCG with cycle walking.
+       the bare power of two LCG gives very regular orders (the low bits just cycle) so its output is
+       scrambled with a random bijection of the same range'''
+    __slots__ = ("size", "modulus", "shift", "multiplier", "increment", "keys", "state", "position")
+
+    def __init__(self, size):
+        self.reset(size)
+
+    def reset(self, size):
+        '''start a new random permutation for the given number of items'''
+        self.size = size
+        # power of two modulus, so the LCG has a full period if the increment is odd and multiplier = 1 mod 4
+        self.modulus = 4
+        bits = 2
+        while self.modulus < size:
+            self.modulus *= 2
+            bits += 1
+        self.shift = (bits + 1) // 2
+        self.multiplier = random.randrange(self.modulus // 4) * 4 + 1
+        self.increment = random.randrange(self.modulus // 2) * 2 + 1
+        # xor key, odd multiplier and xor key of the output mixing, each step is a bijection modulo 2^bits
+        self.keys = (random.randrange(self.modulus), random.randrange(self.modulus // 2) * 2 + 1,
+                     random.randrange(self.modulus))
+        self.state = random.randrange(self.modulus)
+        self.position = 0
+
+    def step(self, state):
+        '''returns the next state of the LCG and its (mixed) output value'''
+        state = (self.multiplier * state + self.increment) % self.modulus
+        mask = self.modulus - 1
+        value = ((state ^ self.keys[0]) * self.keys[1]) & mask
+        value ^= value >> self.shift
+        value = ((value * self.keys[1]) & mask) ^ self.keys[2]
+        return state, value
+
+    def next(self):
+        '''returns the next index, a new permutation is started once all indexes were visited'''
+        if self.position >= self.size:
+            self.reset(self.size)
+        # cycle walking: skip the values outside our range, on average less than 2 steps
+        while True:
+            self.state, value = self.step(self.state)
+            if value < self.size:
+                break
+        self.position += 1
+        return value
+
+    def peek(self, count):
+        '''returns the next (max count) indexes of the current permutation without advancing the cursor'''
+        result = []
+        state = self.state
+        for _ in xrange(min(count, self.size - self.position)):
+            while True:
+                state, value = self.step(state)
+                if value < self.size:
+                    break
+            result.append(value)
+        return result
+
+    def take(self, count, size):
+        '''returns the next (max count) indexes for a source with the given size, resets if the size changed'''
+        if size != self.size:
+            self.reset(size)
+        return [self.next() for _ in xrange(min(count, size))]
+
+
+class ShuffleCursor(object):
+    '''Cursor over a list in memory: a shuffled order of all indexes, reshuffled for every pass'''
+    __slots__ = ("size", "order", "position")
+
+    def __init__(self, size):
+        self.reset(size)
+
+    def reset(self, size):
+        '''start a new shuffled pass over the given number of items'''
+        last = self.order[-1] if getattr(self, "order", None) and size == self.size else None
+        self.size = size
+        self.order = range(size)
+        random.shuffle(self.order)
+        if size > 1 and self.order[0] == last:
+            # don't show the same item twice in a row at the start of a new pass
+            self.order[0], self.order[-1] = self.order[-1], self.order[0]
+        self.position = 0
+
+    def next(self):
+        '''returns the next index, a new pass is started once all indexes were visited'''
+        if self.position >= self.size:
+            self.reset(self.size)
+        self.position += 1
+        return self.order[self.position - 1]
+
+    def peek(self, count):
+        '''returns the next (max count) indexes of the current pass without advancing the cursor'''
+        return self.order[self.position:self.position + count]
+
+    def take(self, count, size):
+        '''returns the next (max count) indexes for a list with the given size, resets if the size changed'''
+        if size != self.size:
+            self.reset(size)
+        return [self.next() for _ in xrange(min(count, size))]
+
+
+class AliasSampler(object):
+    '''Weighted random choice in O(1) per pick using Vose's alias method'''
+    __slots__ = ("keys", "weights", "probabilities", "aliases")
+
+    def __init__(self, keys, weights):
+        self.keys = tuple(keys)
+        self.weights = tuple(weights)
+        count = len(self.keys)
+        total = float(sum(self.weights))
+        self.probabilities = [1.0] * count
+        self.aliases = range(count)
+        if not total:
+            return
+        scaled = [weight * count / total for weight in self.weights]
+        small = [index for index, value in enumerate(scaled) if value < 1]
+        large = [index for index, value in enumerate(scaled) if value >= 1]
+        while small and large:
+            less = small.pop()
+            more = large.pop()
+            self.probabilities[less] = scaled[less]
+            self.aliases[less] = more
+            scaled[more] += scaled[less] - 1
+            if scaled[more] < 1:
+                small.append(more)
+            else:
+                large.append(more)
+
+    def pick(self):
+        '''returns a random key, the chance for each key is proportional to its weight'''
+        if not self.keys or not any(self.weights):
+            return None
+        index = random.randrange(len(self.keys))
+        if random.random() < self.probabilities[index]:
+            return self.keys[index]
+        return self.keys[self.aliases[index]]
@@ -0,0 +1,101 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+    Timer heap based scheduler for the backgrounds service.
+    Instead of waking up every second the service sleeps until the next job is due.
+'''
+
+import heapq
+import itertools
+import threading
+import time
+from utils import log_exception
+
+MAX_WAIT = 600  # never sleep longer than this amount of seconds
+
+
+class Scheduler():
+    '''Runs the jobs of the backgrounds service when they are due'''
+
+    def __init__(self, event=None):
+        self.event = event or threading.Event()
+        self.lock = threading.Lock()
+        self.heap = []
+        self.jobs = {}  # name --> (func, interval, due)
+        self.counter = itertools.count()
+
+    def add_job(self, name, func, interval, delay=None):
+        '''add (or replace) a job which runs every interval seconds, the first run is after delay seconds'''
+        if delay is None:
+            delay = interval
+        due = time.time() + delay
+        with self.lock:
+            self.jobs[name] = (func, interval, due)
+            heapq.heappush(self.heap, (due, next(self.counter), name))
+        # wake up the service loop as the new job might be due before the current sleep ends
+        self.event.set()
+
+    def set_job(self, name, func, interval):
+        '''add the job if it doesn't exist yet or (re)schedule it if its interval changed'''
+        with self.lock:
+            job = self.jobs.get(name)
+        if not job or job[1] != interval:
+            self.add_job(name, func, interval)
+
+    def remove_job(self, name):
+        '''remove the job from the schedule, entries left in the heap are skipped'''
+        with self.lock:
+            self.jobs.pop(name, None)
+
+    def has_job(self, name):
+        '''check if a job with the given name is scheduled'''
+        return name in self.jobs
+
+    def next_due(self):
+        '''returns the timestamp of the first job that is due or None if there are no jobs'''
+        with self.lock:
+            while self.heap:
+                due, _, name = self.heap[0]
+                job = self.jobs.get(name)
+                if job and job[2] == due:
+                    return due
+                # stale entry for a removed or rescheduled job
+                heapq.heappop(self.heap)
+        return None
+
+    def run_pending(self, exit_check=None):
+        '''run all jobs which are due, a job may return the number of seconds until its next run'''
+        while not (exit_check and exit_check()):
+            due = self.next_due()
+            if due is None or due > time.time():
+                break
+            with self.lock:
+                due, _, name = heapq.heappop(self.heap)
+                func, interval = self.jobs[name][:2]
+            next_run = None
+            try:
+                next_run = func()
+            except Exception as exc:
+                log_exception(__name__, exc)
+            if next_run is None:
+                next_run = interval
+            with self.lock:
+                job = self.jobs.get(name)
+                if job and job[2] == due:
+                    if next_run:
+                        # reschedule, unless the job was replaced while it was running
+                        due = time.time() + next_run
+                        self.jobs[name] = (func, interval, due)
+                        heapq.heappush(self.heap, (due, next(self.counter), name))
+                    else:
+                        # one-shot job
+                        del self.jobs[name]
+
+    def wait(self):
+        '''sleep until the next job is due or until we are woken up by a new job or stop request'''
+        due = self.next_due()
+        timeout = MAX_WAIT if due is None else min(MAX_WAIT, due - time.time())
+        if timeout > 0:
+            self.event.wait(timeout)
+        self.event.clear()
@@ -20,12 +20,12 @@ import xbmcaddon
 class SmartShortCuts():
     '''Smart shortcuts listings'''
     exit = False
-    all_nodes = {}
-    toplevel_nodes = []
     build_busy = False
 
     def __init__(self, bgupdater):
         self.bgupdater = bgupdater
+        self.all_nodes = {}
+        self.toplevel_nodes = []
 
     def get_smartshortcuts_nodes(self):
         '''return all smartshortcuts paths for which an image should be generated'''
@@ -47,6 +47,7 @@ class SmartShortCuts():
             self.plex_nodes()
             # set all toplevel nodes in window prop for exchange with skinshortcuts
             self.bgupdater.set_winprop("all_smartshortcuts", repr(self.toplevel_nodes))
+            self.bgupdater.propwriter.flush()
             self.build_busy = False
 
     def emby_nodes(self):
@@ -0,0 +1,141 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+    Performance metrics of the backgrounds service.
+    Counters and latency histograms are collected in memory, published as SkinHelper.Backgrounds.Stats.*
+    window properties and periodically dumped as json into the addon_data folder so builds and devices
+    can be compared without attaching a debugger.
+'''
+
+import bisect
+import json
+import threading
+import time
+from contextlib import contextmanager
+import xbmcvfs
+
+STATS_PATH = "special://profile/addon_data/script.skin.helper.backgrounds/"
+STATS_FILE = STATS_PATH + "stats.json"
+STATS_PREFIX = "SkinHelper.Backgrounds.Stats."
+HISTOGRAM_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)  # upper bounds in ms
+
+
+class Histogram(object):
+    '''Latency histogram with fixed buckets'''
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        '''add a value (in ms)'''
+        self.counts[bisect.bisect_left(HISTOGRAM_BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def get_percentile(self, percentile):
+        '''returns the upper bound of the bucket which holds the given percentile'''
+        if not self.count:
+            return 0
+        rank = self.count * percentile / 100.0
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return HISTOGRAM_BUCKETS[index] if index < len(HISTOGRAM_BUCKETS) else int(self.max)
+        return int(self.max)
+
+    def to_dict(self):
+        '''returns the histogram as dict for the json dump'''
+        return {
+            "count": self.count,
+            "avg": round(self.total / self.count, 1) if self.count else 0,
+            "p50": self.get_percentile(50),
+            "p95": self.get_percentile(95),
+            "max": round(self.max, 1),
+            "buckets": dict(("le%s" % bound, count) for bound, count in zip(HISTOGRAM_BUCKETS, self.counts)
+                            if count),
+            "overflow": self.counts[-1]
+        }
+
+    def __str__(self):
+        return "count: %s - avg: %.1f ms - p95: %s ms - max: %.1f ms" % (
+            self.count, self.total / self.count if self.count else 0, self.get_percentile(95), self.max)
+
+
+class Metrics(object):
+    '''Collects the counters and histograms of the service'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.started = time.time()
+
+    def increment(self, name, value=1):
+        '''increment a counter'''
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_value(self, name, value):
+        '''set a counter to a value which is tracked elsewhere (e.g. the property writer stats)'''
+        with self.lock:
+            self.counters[name] = value
+
+    def observe(self, name, value):
+        '''add a value (in ms) to a histogram'''
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if not histogram:
+                histogram = Histogram()
+                self.histograms[name] = histogram
+            histogram.add(value)
+
+    @contextmanager
+    def timer(self, name):
+        '''measure the time of the with block in the given histogram'''
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, (time.time() - start) * 1000)
+
+    def snapshot(self):
+        '''returns all metrics as dict'''
+        with self.lock:
+            return {
+                "timestamp": int(time.time()),
+                "uptime": int(time.time() - self.started),
+                "counters": dict(self.counters),
+                "histograms": dict((name, histogram.to_dict()) for name, histogram in self.histograms.iteritems())
+            }
+
+    def publish(self, propwriter):
+        '''set all metrics as window properties'''
+        with self.lock:
+            values = [(name, str(value)) for name, value in self.counters.iteritems()]
+            values += [(name, str(histogram)) for name, histogram in self.histograms.iteritems()]
+        for name, value in values:
+            propwriter.set(STATS_PREFIX + name, value)
+
+    def dump(self):
+        '''write all metrics as json into the addon_data folder'''
+        if not xbmcvfs.exists(STATS_PATH):
+            xbmcvfs.mkdirs(STATS_PATH)
+        stats_file = xbmcvfs.File(STATS_FILE, "w")
+        try:
+            stats_file.write(json.dumps(self.snapshot(), indent=2, sort_keys=True))
+        finally:
+            stats_file.close()
+
+
+def get_source_name(win_prop):
+    '''short name of a background source to use in the metric names'''
+    if win_prop.startswith("SkinHelper."):
+        win_prop = win_prop[11:]
+    return win_prop
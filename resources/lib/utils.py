@@ -6,7 +6,9 @@
 import xbmcgui
 import xbmc
 import sys
+import threading
 import urllib
+from collections import OrderedDict
 from traceback import format_exc
 
 ADDON_ID = "script.skin.helper.backgrounds"
@@ -65,3 +67,35 @@ def get_content_path(lib_path):
     if "&reload=" in lib_path:
         lib_path = lib_path.split("&reload=")[0]
     return lib_path
+
+
+class LRUCache(object):
+    '''thread safe dict with a max number of entries, the least recently used entries are dropped'''
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_set(self, key, func):
+        '''returns the cached value for key, func(key) is called to get the value on a cache miss'''
+        with self.lock:
+            value = self.entries.pop(key, None)
+            if value is not None:
+                # re-insert to mark as most recently used
+                self.entries[key] = value
+                self.hits += 1
+                return value
+            self.misses += 1
+        value = func(key)
+        with self.lock:
+            self.entries[key] = value
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return value
+
+    def get_stats(self):
+        '''returns the number of entries, hits and misses'''
+        return len(self.entries), self.hits, self.misses
@@ -9,221 +9,484 @@
 '''
 
 from utils import log_msg, log_exception
+from artindex import ARTINDEX_PATH
+from stats import get_source_name
+from wallrender import SUPPORTS_PIL, TILE_CACHE, get_wall_layout, init_worker, prune_tiles, render_wall_job
+from workerpool import WorkerPool
 import xbmc
 import xbmcvfs
+import json
+import os
 import random
-import io
+import threading
+import time
+import zlib
+from collections import deque
 
 WALLS_PATH = "special://profile/addon_data/script.skin.helper.backgrounds/wall_backgrounds/"
+TILES_PATH = "special://profile/addon_data/script.skin.helper.backgrounds/wall_tiles/"
+MANIFEST_VERSION = 2
+MAX_WALL_PATCHES = 10  # number of incremental updates after which the whole wall is rendered again
+INVALID_IMAGES_FILE = WALLS_PATH + "invalidimages.json"
+INVALID_IMAGES_TTL = 30 * 86400  # images which failed to decode are skipped for 30 days
+EXISTS_TTL = 3600  # seconds the result of an existence check is reused
+EXISTS_WORKERS = 4
+EXISTS_TIMEOUT = 120
+WALL_PAGE_SIZE = 500  # number of items per json call when a collection is listed for the walls
 
-# IMPORT PIL/PILLOW ###################################
-SUPPORTS_PIL = False
-
-try:
-    # prefer Pillow
-    from PIL import Image
-    TMP = Image.new("RGB", (1, 1))
-    del TMP
-    SUPPORTS_PIL = True
-except Exception as exc:
-    log_exception(__name__, exc)
-    try:
-        # fallback to traditional PIL
-        import Image
-        TMP = Image.new("RGB", (1, 1))
-        del TMP
-        SUPPORTS_PIL = True
-    except Exception as exc:
-        log_exception(__name__, exc)
+# all walls we provide: (window property, library path, art type)
+WALLS = (
+    ("SkinHelper.AllMoviesBackground.Wall", ARTINDEX_PATH + "movies/all", "fanart"),
+    ("SkinHelper.AllMoviesBackground.Poster.Wall", ARTINDEX_PATH + "movies/all", "poster"),
+    ("SkinHelper.AllMusicBackground.Wall", "musicdb://artists/", "fanart"),
+    ("SkinHelper.AllMusicSongsBackground.Wall", "musicdb://songs/", "thumb"),
+    ("SkinHelper.AllTvShowsBackground.Wall", ARTINDEX_PATH + "tvshows/all", "fanart"),
+    ("SkinHelper.AllTvShowsBackground.Poster.Wall", ARTINDEX_PATH + "tvshows/all", "poster")
+)
+
+
+def supports_processes():
+    '''check if the walls can be rendered in worker processes: multiprocessing starts its workers with
+       sys.executable where it can not fork, inside Kodi that would start another Kodi instance per worker'''
+    return (hasattr(os, "fork") and not xbmc.getCondVisibility("System.Platform.Windows") and
+            not xbmc.getCondVisibility("System.Platform.Android"))
+
+
+def get_item_hash(image):
+    '''short hash of an image to store the items of a collection in the manifest'''
+    if isinstance(image, unicode):
+        image = image.encode("utf-8")
+    return zlib.crc32(image) & 0xffffffff
 
 
 class WallImages():
     '''Generate wall images from collection of images'''
     exit = False
-    build_busy = {}
     max_wallimages = 20
-    all_wall_images = {}
-    manual_walls = {}
+    render_processes = 1  # number of processes used to render the walls, 1 renders them in this process
 
     def __init__(self, bgupdater):
         self.bgupdater = bgupdater
+        self.build_busy = {}
+        self.all_wall_images = {}
+        self.exists_cache = {}  # image --> (exists, timestamp of the check), shared by all walls
+        self.exists_pruned = time.time()
+        self.exists_pool = WorkerPool(EXISTS_WORKERS, name="SkinHelperBackgrounds.WallImages")
+        self.invalid_images = None  # image --> timestamp it failed to decode, loaded on first use
+        self.invalid_lock = threading.Lock()
+
+    def stop(self):
+        '''stop building the walls'''
+        self.exit = True
+        self.exists_pool.stop()
 
     def update_wallbackgrounds(self):
         '''generates wall images from collection of images from the library'''
         if self.max_wallimages and SUPPORTS_PIL:
-            walls = []
-            walls.append(("SkinHelper.AllMoviesBackground.Wall", "videodb://movies/titles/", "fanart"))
-            walls.append(("SkinHelper.AllMoviesBackground.Poster.Wall", "videodb://movies/titles/", "poster"))
-            walls.append(("SkinHelper.AllMusicBackground.Wall", "musicdb://artists/", "fanart"))
-            walls.append(("SkinHelper.AllMusicSongsBackground.Wall", "musicdb://songs/", "thumb"))
-            walls.append(("SkinHelper.AllTvShowsBackground.Wall", "videodb://tvshows/titles/", "fanart"))
-            walls.append(("SkinHelper.AllTvShowsBackground.Poster.Wall", "videodb://tvshows/titles/", "poster"))
             # get the wall images...
-            for wall in walls:
+            for wall in WALLS:
                 if not self.exit:
                     self.update_wall_background(wall)
 
+    def invalidate_walls(self, is_affected):
+        '''mark the walls for which the library path is affected by a library change for an update'''
+        for win_prop, lib_path, _ in WALLS:
+            if is_affected(lib_path):
+                log_msg("WALL %s will be updated because of a library change" % win_prop)
+                self.all_wall_images.pop(win_prop, None)
+
     def update_wall_background(self, wall_tuple):
         '''update a single wall background'''
 
         wall_library_path = wall_tuple[1]
         wall_win_prop = wall_tuple[0]
-        wall_win_prop_bw = wall_win_prop + ".BW"
         wall_type = wall_tuple[2]
         wall_images = []
-        if wall_win_prop in self.all_wall_images and xbmcvfs.exists(WALLS_PATH):
+        if self.build_busy.get(wall_win_prop, False):
+            # the walls are being built, rotate the ones which are ready already
+            wall_images = self.all_wall_images.get(wall_win_prop, [])
+        elif wall_win_prop in self.all_wall_images and xbmcvfs.exists(WALLS_PATH):
             # the wall images are already cached in memory
             wall_images = self.all_wall_images[wall_win_prop]
         else:
             # no wall images in cache, we must retrieve them
-            images = self.get_images_from_vfspath(wall_library_path, wall_type)
+            images, items = self.get_images_from_vfspath(wall_library_path, wall_type)
             if images:
-                wall_images = self.get_wallimages(wall_win_prop, images, wall_type)
+                wall_images = self.get_wallimages(wall_win_prop, images, wall_type, items)
                 self.all_wall_images[wall_win_prop] = wall_images
         if wall_images:
             # we have some wall images, select a random one and set as window prop
             wall_image = random.choice(wall_images)
             if wall_image:
-                self.bgupdater.win.setProperty(wall_win_prop, wall_image["wall"])
-                self.bgupdater.win.setProperty(wall_win_prop_bw, wall_image["wallbw"])
+                self.set_wall_image(wall_win_prop, wall_image)
+
+    def set_wall_image(self, win_prop, wall_image):
+        '''set the color and the black and white wall image as window props'''
+        self.bgupdater.propwriter.set(win_prop, wall_image["wall"])
+        self.bgupdater.propwriter.set(win_prop + ".BW", wall_image["wallbw"])
+        self.bgupdater.propwriter.flush()
+
+    def publish_wall_image(self, win_prop, wall_image):
+        '''make a finished wall available for the rotation while the other walls are still rendering'''
+        wall_images = self.all_wall_images.setdefault(win_prop, [])
+        wall_images.append(wall_image)
+        if len(wall_images) == 1:
+            # first wall of the collection, show it right away instead of waiting for the next rotation
+            self.set_wall_image(win_prop, wall_image)
 
-    def get_wallimages(self, win_prop, images, art_type="fanart"):
-        '''gets or builds all wall images for the collection'''
+    def get_wallimages(self, win_prop, images, art_type="fanart", items=None):
+        '''gets, updates or builds all wall images for the collection, items are the hashes of the images'''
         wall_images = []
 
         if self.build_busy.get(win_prop, False):
             # there is already a build in progress for this wall, skip...
             log_msg("Build WALL %s skipped - another build in progress" % win_prop)
-            return wall_images
+            return self.all_wall_images.get(win_prop, wall_images)
         elif self.exit:
             return wall_images
         else:
             self.build_busy[win_prop] = True
 
-        # if there is a big change in number of items we force a rebuild
-        lastcount = 0
-        curcount = len(images)
-        force_rebuild = False
-        last_count_setting = self.bgupdater.addon.getSetting(win_prop)
-        if last_count_setting:
-            lastcount = int(last_count_setting)
-        if (lastcount + 10) < curcount:
-            force_rebuild = True
-            self.bgupdater.addon.setSetting(win_prop, str(curcount))
-        log_msg("%s --> curcount: %s - lastcount: %s" % (win_prop, curcount, lastcount))
-
-        # check if our path exists
-        if not xbmcvfs.exists(WALLS_PATH):
-            xbmcvfs.mkdirs(WALLS_PATH)
-            xbmcvfs.mkdir(WALLS_PATH)
-
-        # reuse the existing images - only rebuild if really needed
-        if not force_rebuild:
-            files = xbmcvfs.listdir(WALLS_PATH)[1]
-            for file in files:
-                # return color and bw image combined - only if both are found
-                color_path = WALLS_PATH + file.replace("_BW", "")
-                black_path = WALLS_PATH + file
-                if file.startswith("%s_BW." % win_prop) and xbmcvfs.exists(color_path):
-                    wall_images.append(
-                        {
-                            "wallbw": black_path,
-                            "wall": color_path
-                        })
-
-        # skip if we do not have enough source images
-        if images < (self.max_wallimages * 2):
-            log_msg("Building WALL background skipped - not enough source images")
-            return wall_images
-
-        # build wall images if we do not already have (enough) wall images prebuilt on the filesystem
-        if len(wall_images) < self.max_wallimages:
-            wall_images = self.build_wallimages(win_prop, images, art_type)
+        try:
+            # skip if we do not have enough source images
+            if len(images) < (self.max_wallimages * 2):
+                log_msg("Building WALL background skipped - not enough source images")
+                return wall_images
 
-        self.build_busy[win_prop] = False
+            # reuse the existing walls, only the tiles of changed library items are rendered again
+            manifest = self.load_manifest(win_prop, art_type)
+            if manifest:
+                wall_images = self.update_wallimages(win_prop, images, art_type, manifest, items)
+            else:
+                wall_images = self.build_wallimages(win_prop, images, art_type, items)
+        finally:
+            self.build_busy[win_prop] = False
         return wall_images
 
-    def build_wallimages(self, win_prop, wall_images, art_type):
-        '''build wall images with PIL module for the collection'''
-        return_images = []
+    def build_wallimages(self, win_prop, wall_images, art_type, items=None):
+        '''build all wall images with PIL module for the collection'''
+        layout = get_wall_layout(art_type)
+        images_required = layout[0] * layout[1]
+        if items is None:
+            items = [get_item_hash(image) for image in wall_images]
+        walls = []
+        # only the images which end up on the walls are checked
+        wall_images = self.pick_images(wall_images, images_required * self.max_wallimages)
+        if wall_images:
+            # duplicate images if we don't have enough
+            while len(wall_images) < images_required:
+                wall_images += wall_images
+            for _ in range(self.max_wallimages):
+                random.shuffle(wall_images)
+                walls.append({"tiles": wall_images[:images_required], "patches": 0})
+        return self.render_wallimages(win_prop, art_type, walls, [None] * len(walls), items)
+
+    def update_wallimages(self, win_prop, images, art_type, manifest, items=None):
+        '''update the existing walls: the tiles of removed items are replaced and new items are mixed in'''
+        layout = get_wall_layout(art_type)
+        images_required = layout[0] * layout[1]
+        known = set(manifest["items"])
+        if items is None:
+            items = [get_item_hash(image) for image in images]
+        walls = manifest["walls"][:self.max_wallimages]
+        changes = self.get_wall_changes(walls, images, known)
+        while len(walls) < self.max_wallimages:
+            # the number of walls was increased in the settings
+            tiles = self.pick_images(images, images_required)
+            if not tiles:
+                break
+            while len(tiles) < images_required:
+                tiles += tiles
+            walls.append({"tiles": tiles[:images_required], "patches": 0})
+            changes.append(None)
+        for count, wall in enumerate(walls):
+            if changes[count] and wall["patches"] >= MAX_WALL_PATCHES:
+                # render the whole wall once in a while so the jpeg artifacts of the patches don't add up
+                changes[count] = None
+            elif not all(xbmcvfs.exists(wall_file) for wall_file in self.get_wall_files(win_prop, count)):
+                changes[count] = None
+        log_msg("%s --> %s images, %s tiles changed, %s walls rebuilt" % (
+            win_prop, len(images), sum(len(changed) for changed in changes if changed),
+            len([changed for changed in changes if changed is None])))
+        if any(changed is None or changed for changed in changes) or len(walls) != len(manifest["walls"]):
+            return self.render_wallimages(win_prop, art_type, walls, changes, items)
+        if set(items) != known:
+            self.save_manifest(win_prop, art_type, walls, items)
+        return [self.get_wall_image(win_prop, count) for count in range(len(walls))]
+
+    def get_wall_changes(self, walls, images, known):
+        '''assign images to the tile slots of the walls for a changed library,
+           images are all items of the collection and known the hashes of the items at the previous update.
+           returns the changed slot indexes of each wall'''
+        if not walls:
+            return []
+        current = set(images)
+        changes = [set() for _ in walls]
+        # the tiles of removed items (or images which failed to decode) must be replaced
+        free_slots = [(count, index) for count, wall in enumerate(walls)
+                      for index, image in enumerate(wall["tiles"]) if image not in current]
+        random.shuffle(free_slots)
+        # the new items replace the free slots first, then random tiles spread over all walls
+        new_images = [image for image in images if get_item_hash(image) not in known]
+        new_images = self.pick_images(new_images, sum(len(wall["tiles"]) for wall in walls))
+        for number, image in enumerate(new_images):
+            if free_slots:
+                count, index = free_slots.pop()
+            else:
+                count = number % len(walls)
+                unchanged = [index for index in range(len(walls[count]["tiles"])) if index not in changes[count]]
+                if not unchanged:
+                    break
+                index = random.choice(unchanged)
+            walls[count]["tiles"][index] = image
+            changes[count].add(index)
+        if free_slots:
+            # the remaining free slots get random images of the collection, preferably ones which are not shown yet
+            shown = set(image for wall in walls for image in wall["tiles"])
+            fill_images = self.pick_images([image for image in images if image not in shown], len(free_slots))
+            fill_images = fill_images or self.pick_images(images, len(free_slots))
+            if fill_images:
+                for number, (count, index) in enumerate(free_slots):
+                    walls[count]["tiles"][index] = fill_images[number % len(fill_images)]
+                    changes[count].add(index)
+        return [sorted(changed) for changed in changes]
+
+    def pick_images(self, images, count):
+        '''returns (max count) random images which exist, only the picked images are checked'''
+        candidates = list(images)
+        random.shuffle(candidates)
+        result = []
+        while candidates and len(result) < count and not self.exit:
+            batch = candidates[:count - len(result)]
+            del candidates[:len(batch)]
+            result += self.filter_images(batch)
+        return result
+
+    def render_wallimages(self, win_prop, art_type, walls, changes, items):
+        '''render the walls with PIL module, changes contains the slot indexes to render for each wall
+           (None renders the whole wall) and the manifest with the items of the collection is saved afterwards'''
         if not SUPPORTS_PIL:
             log_msg("Wall backgrounds disabled - PIL is not supported on this device!", xbmc.LOGWARNING)
             return []
         log_msg("Building Wall background for %s - this might take a while..." % win_prop)
-        if art_type == "thumb":
-            # square images
-            img_columns = 11
-            img_rows = 7
-            img_width = 260
-            img_height = 260
-        elif art_type == "poster":
-            # poster images
-            img_columns = 15
-            img_rows = 5
-            img_width = 128
-            img_height = 216
-        else:
-            # landscaped images
-            img_columns = 8
-            img_rows = 8
-            img_width = 240
-            img_height = 135
-        size = img_width, img_height
-
-        # build the wall images
-        images_required = img_columns * img_rows
-        if wall_images:
-            # duplicate images if we don't have enough
+        stats = self.bgupdater.stats
+        start = time.time()
+        layout = get_wall_layout(art_type)
+        for path in (WALLS_PATH, TILES_PATH):
+            if not xbmcvfs.exists(path):
+                xbmcvfs.mkdirs(path)
+        tile_path = xbmc.translatePath(TILES_PATH).decode("utf-8")
+        TILE_CACHE.path = tile_path
 
-            while len(wall_images) < images_required:
-                wall_images += wall_images
+        # the walls which are not rendered from scratch stay available for the rotation during the build
+        self.all_wall_images[win_prop] = [self.get_wall_image(win_prop, count)
+                                          for count, changed in enumerate(changes) if changed is not None]
 
-            for count in range(self.max_wallimages):
-                if self.exit:
-                    return []
-                random.shuffle(wall_images)
-                img_canvas = Image.new("RGBA", (img_width * img_columns, img_height * img_rows))
-                img_count = 0
-                for x in range(img_rows):
-                    for y in range(img_columns):
-                        file = xbmcvfs.File(wall_images[img_count])
-                        try:
-                            img_obj = io.BytesIO(bytearray(file.readBytes()))
-                            img = Image.open(img_obj)
-                            img = img.resize(size)
-                            img_canvas.paste(img, (y * img_width, x * img_height))
-                            del img
-                            del img_obj
-                        except Exception:
-                            log_msg("Invalid image file found! --> %s" % wall_images[img_count], xbmc.LOGWARNING)
-                        finally:
-                            file.close()
-                            img_count += 1
-
-                # save the files..
-                out_file = "%s%s.%s.jpg" % (WALLS_PATH, win_prop, count)
-                out_file = xbmc.translatePath(out_file).decode("utf-8")
-                if xbmcvfs.exists(out_file):
-                    xbmcvfs.delete(out_file)
-                    xbmc.sleep(500)
-                img_canvas.save(out_file, "JPEG")
+        # build the wall images, the jobs are prepared while the walls are rendered so the first wall is
+        # published as soon as its own tiles are read
+        jobs = self.get_wall_jobs(win_prop, layout, tile_path, walls, changes)
+        results = self.render_walls(jobs, len([changed for changed in changes if changed is None or changed]))
+        invalid_found = False
+        source = get_source_name(win_prop)
+        wall_start = start
+        for (count, base_file), (failed, timings, cache_stats, missing) in results:
+            wall = walls[count]
+            if missing:
+                # the tiles were removed from the tile cache after the job was prepared, render them from the source
+                missing_failed, missing_timings = self.render_missing_tiles(
+                    win_prop, count, wall, layout, tile_path, missing)
+                failed += missing_failed
+                timings += missing_timings
+            for index in failed:
+                log_msg("Invalid image file found! --> %s" % wall["tiles"][index], xbmc.LOGWARNING)
+                stats.increment("walls.decodefailed")
+                self.add_invalid_image(wall["tiles"][index])
+                invalid_found = True
+                # the empty slot is filled with another image by the next update
+                wall["tiles"][index] = None
+            for timing in timings:
+                stats.observe("walls.tile", timing * 1000)
+            stats.increment("walls.tiles.rendered", len(timings))
+            stats.increment("walls.tiles.memoryhits", cache_stats[0])
+            stats.increment("walls.tiles.diskhits", cache_stats[1])
+            stats.increment("walls.tiles.decoded", cache_stats[2])
+            if base_file is None:
+                self.publish_wall_image(win_prop, self.get_wall_image(win_prop, count))
+            # build time of this wall: since the previous wall was ready, reading its tiles included
+            now = time.time()
+            stats.observe("walls.wall.%s" % source, (now - wall_start) * 1000)
+            wall_start = now
+        if self.exit:
+            return []
+        prune_tiles(tile_path)
+        if invalid_found:
+            self.save_invalid_images()
+        self.save_manifest(win_prop, art_type, walls, items)
+        stats.observe("walls.build.%s" % source, (time.time() - start) * 1000)
+        log_msg("Building Wall background %s DONE" % win_prop)
+        return [self.get_wall_image(win_prop, count) for count in range(len(walls))]
 
-                out_file_bw = "%s%s_BW.%s.jpg" % (WALLS_PATH, win_prop, count)
+    def get_wall_jobs(self, win_prop, layout, tile_path, walls, changes):
+        '''yields the render jobs of the walls one by one, the tile sources of a wall are read when its job is needed'''
+        tile_size = (layout[2], layout[3])
+        for count, (wall, changed) in enumerate(zip(walls, changes)):
+            if self.exit:
+                return
+            if changed is not None and not changed:
+                continue
+            out_file, out_file_bw = self.get_wall_files(win_prop, count)
+            if changed is None:
+                out_file = self.prepare_wall_file(out_file)
+                out_file_bw = self.prepare_wall_file(out_file_bw)
+                changed = range(len(wall["tiles"]))
+                wall["patches"] = 0
+                base_file = None
+            else:
+                out_file = xbmc.translatePath(out_file).decode("utf-8")
                 out_file_bw = xbmc.translatePath(out_file_bw).decode("utf-8")
-                if xbmcvfs.exists(out_file_bw):
-                    xbmcvfs.delete(out_file_bw)
-                    xbmc.sleep(500)
-                img_canvas = img_canvas.convert("L")
-                img_canvas.save(out_file_bw, "JPEG")
-                del img_canvas
-                # add our images to the dict
-                return_images.append({"wall": out_file, "wallbw": out_file_bw})
-        log_msg("Building Wall background %s DONE" % win_prop)
-        return return_images
+                base_file = out_file
+                wall["patches"] += 1
+            tiles = [(tile, None) for tile in wall["tiles"]]
+            # only the data of the walls which are rendering is kept in memory, the tiles of the previous walls
+            # are in the tile cache by now
+            sources = {}  # image --> tile source, None if the tile is cached already
+            for index in changed:
+                tile = wall["tiles"][index]
+                if tile not in sources:
+                    sources[tile] = self.get_tile_source(tile, tile_size)
+                tiles[index] = (tile, sources[tile])
+            yield (count, base_file), (tiles, layout, out_file, out_file_bw, tile_path, base_file, changed)
+            tiles = sources = None
+
+    @staticmethod
+    def get_wall_files(win_prop, count):
+        '''returns the color and the black and white file of a wall'''
+        return "%s%s.%s.jpg" % (WALLS_PATH, win_prop, count), "%s%s_BW.%s.jpg" % (WALLS_PATH, win_prop, count)
+
+    def get_wall_image(self, win_prop, count):
+        '''returns the color and bw image of a wall combined'''
+        wall_file, wall_file_bw = self.get_wall_files(win_prop, count)
+        return {"wall": wall_file, "wallbw": wall_file_bw}
+
+    @staticmethod
+    def get_manifest_file(win_prop):
+        '''returns the path of the manifest with the tiles of the walls'''
+        return "%s%s.json" % (WALLS_PATH, win_prop)
+
+    def load_manifest(self, win_prop, art_type):
+        '''returns the manifest of the walls (the source image of each tile slot) or None if there is no valid one'''
+        manifest_file = self.get_manifest_file(win_prop)
+        if not xbmcvfs.exists(manifest_file):
+            return None
+        manifest_file = xbmcvfs.File(manifest_file)
+        try:
+            manifest = json.loads(manifest_file.read())
+        except Exception as exc:
+            log_exception(__name__, exc)
+            return None
+        finally:
+            manifest_file.close()
+        if manifest.get("version") != MANIFEST_VERSION or manifest.get("layout") != list(get_wall_layout(art_type)):
+            # the walls were built by an older version or with another layout
+            return None
+        return manifest if manifest.get("walls") else None
+
+    def save_manifest(self, win_prop, art_type, walls, items):
+        '''store the source image of each tile slot of the walls and the hashes of all items of the collection'''
+        manifest_file = xbmcvfs.File(self.get_manifest_file(win_prop), "w")
+        try:
+            manifest_file.write(json.dumps({"version": MANIFEST_VERSION, "layout": get_wall_layout(art_type),
+                                            "items": items, "walls": walls}))
+        finally:
+            manifest_file.close()
+
+    @staticmethod
+    def prepare_wall_file(wall_file):
+        '''returns the local path for the wall image, an existing image is removed first'''
+        wall_file = xbmc.translatePath(wall_file).decode("utf-8")
+        if xbmcvfs.exists(wall_file):
+            xbmcvfs.delete(wall_file)
+            xbmc.sleep(500)
+        return wall_file
+
+    @staticmethod
+    def render_missing_tiles(win_prop, count, wall, layout, tile_path, missing):
+        '''render the given tiles on top of the wall, in this process with the source of each tile read first.
+           returns the indexes of the tiles which failed to decode and the time spent on each tile'''
+        tiles = [(tile, None) for tile in wall["tiles"]]
+        for index in missing:
+            tiles[index] = (wall["tiles"][index], WallImages.read_tile_source(wall["tiles"][index]))
+        out_file, out_file_bw = [xbmc.translatePath(wall_file).decode("utf-8")
+                                 for wall_file in WallImages.get_wall_files(win_prop, count)]
+        failed, timings = render_wall_job((tiles, layout, out_file, out_file_bw, tile_path, out_file, missing))[:2]
+        return failed, timings
 
-    def set_manualwall(self, win_prop, limit=20):
+    @staticmethod
+    def get_tile_source(image, tile_size):
+        '''returns the local path of the image or the image data if the image is not a local file,
+           None if the resized tile is in the tile cache already'''
+        if TILE_CACHE.has(image, tile_size):
+            return None
+        return WallImages.read_tile_source(image)
+
+    @staticmethod
+    def read_tile_source(image):
+        '''returns the local path of the image or the image data if the image is not a local file'''
+        local_path = xbmc.translatePath(image)
+        if isinstance(local_path, str):
+            local_path = local_path.decode("utf-8")
+        if os.path.isfile(local_path):
+            return local_path
+        tile_file = xbmcvfs.File(image)
+        try:
+            return bytearray(tile_file.readBytes())
+        finally:
+            tile_file.close()
+
+    def render_walls(self, jobs, num_jobs):
+        '''render the walls in a pool of worker processes if enabled, in this process otherwise.
+           jobs yields (key, job) tuples, the (key, result) of each wall is yielded (in order of the jobs)
+           as soon as it is rendered'''
+        pool = None
+        if self.render_processes > 1 and num_jobs > 1 and supports_processes():
+            try:
+                import multiprocessing
+                pool = multiprocessing.Pool(min(self.render_processes, num_jobs), init_worker)
+            except Exception as exc:
+                # multiprocessing is not available on all platforms, fallback to rendering in this process
+                log_msg("Rendering the walls in worker processes failed (%s) - using a single process" % exc,
+                        xbmc.LOGWARNING)
+        if not pool:
+            for key, job in jobs:
+                if self.exit:
+                    break
+                yield key, render_wall_job(job)
+            return
+        # the number of jobs in flight is bounded as each job holds the data of its tiles
+        pending = deque()  # (key, async result) of the walls which are rendering, in order of the jobs
+        try:
+            for key, job in jobs:
+                pending.append((key, pool.apply_async(render_wall_job, (job,))))
+                del job
+                # publish the finished walls right away, wait only if all processes are busy
+                while pending and (len(pending) >= self.render_processes or pending[0][1].ready()):
+                    key, result = pending.popleft()
+                    yield key, result.get()
+            while pending and not self.exit:
+                key, result = pending.popleft()
+                yield key, result.get()
+        finally:
+            if self.exit:
+                pool.terminate()
+            else:
+                pool.close()
+            pool.join()
+
+    def set_manualwall(self, pool):
         '''set a manual wall by providing the skinner randomly changing images in window props'''
-        images = self.bgupdater.get_images_from_vfspath(self.bgupdater.all_backgrounds_keys[win_prop])
+        win_prop = pool.win_prop
+        limit = pool.wall_limit
+        images = self.bgupdater.get_background_images(pool.lib_path)
         if images:
             if self.bgupdater.win.getProperty("%s.Wall.0" % win_prop):
                 # 1st run was already done so only refresh one random image in the collection...
@@ -231,46 +494,131 @@ class WallImages():
                 for key, value in image.iteritems():
                     random_int = random.randint(0, limit)
                     if key == "fanart":
-                        self.bgupdater.win.setProperty("%s.Wall.%s" % (win_prop, random_int), value)
+                        self.bgupdater.propwriter.set("%s.Wall.%s" % (win_prop, random_int), value)
                     else:
-                        self.bgupdater.win.setProperty("%s.Wall.%s.%s" % (win_prop, random_int, key), value)
+                        self.bgupdater.propwriter.set("%s.Wall.%s.%s" % (win_prop, random_int, key), value)
             else:
                 # first run: set all images
                 for i in range(limit):
                     image = random.choice(images)
                     for key, value in image.iteritems():
                         if key == "fanart":
-                            self.bgupdater.win.setProperty("%s.Wall.%s" % (win_prop, i), value)
+                            self.bgupdater.propwriter.set("%s.Wall.%s" % (win_prop, i), value)
                         else:
-                            self.bgupdater.win.setProperty("%s.Wall.%s.%s" % (win_prop, i, key), value)
+                            self.bgupdater.propwriter.set("%s.Wall.%s.%s" % (win_prop, i, key), value)
 
     def update_manualwalls(self):
         '''manual wall images, provides a collection of images which are randomly changing'''
-        for key, value in self.manual_walls.iteritems():
-            self.set_manualwall(key, value)
+        for pool in self.bgupdater.pools:
+            if pool.wall_limit:
+                self.set_manualwall(pool)
+        self.bgupdater.propwriter.flush()
 
     def get_images_from_vfspath(self, lib_path, arttype):
-        '''get all (unique and existing) images from the given vfs path to build the image wall'''
-        result = []
-        items = self.bgupdater.mutils.kodidb.get_json(
-            "Files.GetDirectory", returntype="", optparam=(
-                "directory", lib_path), fields=[
-                "art", "thumbnail", "fanart"], sort={
-                "method": "random", "order": "descending"}, limits=(0,1000))
-
-        for media in items:
-            image = None
-            if media.get('art', {}).get(arttype):
-                image = media['art'][arttype]
-            elif media.get('art', {}).get('tvshow.%s' % arttype):
-                image = media['art']['tvshow.%s' % arttype]
-            elif media.get('art', {}).get('artist.%s' % arttype):
-                image = media['art']['artist.%s' % arttype]
-            elif arttype == "thumb" and media.get("thumbnail"):
-                image = media["thumbnail"]
-            elif arttype == "fanart" and media.get("fanart"):
-                image = media["fanart"]
-            image = self.bgupdater.mutils.get_clean_image(image)
-            if image and image not in result and xbmcvfs.exists(image):
-                result.append(image)
-        return result
+        '''get all unique images of the collection at the given vfs path, the existence is checked once picked.
+           returns the images and their hashes for the manifest'''
+        if lib_path.startswith(ARTINDEX_PATH):
+            # movies and tvshows are served from the local art index
+            result = self.bgupdater.artindex.get_art(lib_path, arttype)
+            items = [get_item_hash(image) for image in result]
+        else:
+            # all items of the collection so the walls can be compared with the complete library,
+            # listed in pages so a big (music) library is not transferred in a single huge response
+            result = []
+            items = []
+            seen = set()
+            start = 0
+            while not self.exit:
+                page = self.bgupdater.get_json(
+                    "Files.GetDirectory", returntype="", optparam=("directory", lib_path),
+                    fields=["art", "thumbnail", "fanart"], limits=(start, start + WALL_PAGE_SIZE))
+                for media in page:
+                    image = self.get_media_image(media, arttype)
+                    if image and image not in seen:
+                        seen.add(image)
+                        result.append(image)
+                        # the hashes are computed per page, no extra pass over the whole collection
+                        items.append(get_item_hash(image))
+                if len(page) < WALL_PAGE_SIZE:
+                    break
+                start += WALL_PAGE_SIZE
+        invalid_images = self.get_invalid_images()
+        if invalid_images:
+            valid = [index for index, image in enumerate(result) if image not in invalid_images]
+            result = [result[index] for index in valid]
+            items = [items[index] for index in valid]
+        return result, items
+
+    def get_media_image(self, media, arttype):
+        '''returns the (clean) image of the given art type for a media item of a directory listing'''
+        image = None
+        if media.get('art', {}).get(arttype):
+            image = media['art'][arttype]
+        elif media.get('art', {}).get('tvshow.%s' % arttype):
+            image = media['art']['tvshow.%s' % arttype]
+        elif media.get('art', {}).get('artist.%s' % arttype):
+            image = media['art']['artist.%s' % arttype]
+        elif arttype == "thumb" and media.get("thumbnail"):
+            image = media["thumbnail"]
+        elif arttype == "fanart" and media.get("fanart"):
+            image = media["fanart"]
+        return self.bgupdater.get_clean_image(image)
+
+    def filter_images(self, images):
+        '''returns the images which exist and did not fail to decode before'''
+        invalid_images = self.get_invalid_images()
+        images = [image for image in images if image not in invalid_images]
+        now = time.time()
+        if now - self.exists_pruned > EXISTS_TTL:
+            # drop the expired checks so the cache doesn't keep every image which was ever checked
+            self.exists_pruned = now
+            for image, (_, timestamp) in self.exists_cache.items():
+                if timestamp + EXISTS_TTL < now:
+                    self.exists_cache.pop(image, None)
+        unknown = [image for image in images if self.exists_cache.get(image, (False, 0))[1] + EXISTS_TTL < now]
+        if unknown:
+            # check the images in parallel as every check may be a network roundtrip (smb, nfs, http)
+            self.bgupdater.stats.increment("walls.existschecks", len(unknown))
+            for image in unknown:
+                self.exists_pool.submit(self.check_exists, image)
+            self.exists_pool.join(EXISTS_TIMEOUT)
+        return [image for image in images if self.exists_cache.get(image, (False, 0))[0]]
+
+    def check_exists(self, image):
+        '''executed by the workers: check if the image exists and cache the result'''
+        if not self.exit:
+            self.exists_cache[image] = (xbmcvfs.exists(image), time.time())
+
+    def get_invalid_images(self):
+        '''returns the images which failed to decode, the persisted list is loaded on first use'''
+        with self.invalid_lock:
+            if self.invalid_images is None:
+                self.invalid_images = {}
+                if xbmcvfs.exists(INVALID_IMAGES_FILE):
+                    invalid_file = xbmcvfs.File(INVALID_IMAGES_FILE)
+                    try:
+                        min_time = time.time() - INVALID_IMAGES_TTL
+                        self.invalid_images = dict((image, timestamp) for image, timestamp
+                                                   in json.loads(invalid_file.read()).iteritems()
+                                                   if timestamp > min_time)
+                    except Exception as exc:
+                        log_exception(__name__, exc)
+                    finally:
+                        invalid_file.close()
+            return self.invalid_images
+
+    def add_invalid_image(self, image):
+        '''remember an image which failed to decode so it is skipped by the next builds'''
+        invalid_images = self.get_invalid_images()
+        with self.invalid_lock:
+            invalid_images[image] = int(time.time())
+
+    def save_invalid_images(self):
+        '''persist the images which failed to decode'''
+        invalid_images = self.get_invalid_images()
+        with self.invalid_lock:
+            invalid_file = xbmcvfs.File(INVALID_IMAGES_FILE, "w")
+            try:
+                invalid_file.write(json.dumps(invalid_images))
+            finally:
+                invalid_file.close()
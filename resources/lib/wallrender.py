@@ -0,0 +1,202 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+    Rendering of the wall images.
+    Pure functions without any Kodi dependencies so the walls can be composed in worker processes.
+    The serial and the multiprocessing mode use the same functions so the results are identical.
+    Every source image is decoded once at the smallest resolution which is enough for the tile (jpeg draft mode),
+    the resized tiles are kept in a bounded memory cache and as raw files on disk so they are reused by all walls
+    and by later rebuilds.
+'''
+
+import hashlib
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# IMPORT PIL/PILLOW ###################################
+SUPPORTS_PIL = False
+
+try:
+    # prefer Pillow
+    from PIL import Image
+    SUPPORTS_PIL = True
+except Exception:
+    try:
+        # fallback to traditional PIL
+        import Image
+        SUPPORTS_PIL = True
+    except Exception:
+        pass
+
+# art type --> (columns, rows, tile width, tile height)
+WALL_LAYOUTS = {
+    "thumb": (11, 7, 260, 260),  # square images
+    "poster": (15, 5, 128, 216),  # poster images
+    "fanart": (8, 8, 240, 135)  # landscaped images
+}
+
+
+def get_wall_layout(art_type):
+    '''returns the layout of the wall for the given art type'''
+    return WALL_LAYOUTS.get(art_type, WALL_LAYOUTS["fanart"])
+
+
+TILE_MEMORY_LIMIT = 32 * 1024 * 1024  # max bytes of decoded tiles in memory (per process)
+TILE_DISK_LIMIT = 256 * 1024 * 1024  # max bytes of the tile files on disk
+TILE_EXTENSION = ".rgb"
+
+
+def decode_tile(source, size):
+    '''decode a tile from a local file path or from the image data (bytearray) and resize it'''
+    if isinstance(source, bytearray):
+        source = io.BytesIO(source)
+    img = Image.open(source)
+    # let the jpeg decoder scale down while decoding, the result is still at least the size of the tile
+    img.draft("RGB", size)
+    return img.convert("RGB").resize(size)
+
+
+def get_tile_key(name, size):
+    '''returns the cache key of the tile for the source image with the given name (url)'''
+    if isinstance(name, unicode):
+        name = name.encode("utf-8")
+    return hashlib.md5("%s@%sx%s" % (name, size[0], size[1])).hexdigest()
+
+
+class TileCache(object):
+    '''Bounded cache of decoded and resized tiles, in memory and as raw RGB files on disk'''
+
+    def __init__(self, max_memory=TILE_MEMORY_LIMIT):
+        self.max_memory = max_memory
+        self.lock = threading.Lock()  # builds of different walls may run in parallel threads
+        self.path = None  # local folder for the tile files, None disables the disk cache
+        self.memory = OrderedDict()  # key --> raw tile data, least recently used first
+        self.used = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.decodes = 0
+
+    def get_file(self, key):
+        '''returns the path of the tile file'''
+        return os.path.join(self.path, key + TILE_EXTENSION)
+
+    def has(self, name, size):
+        '''check if the tile is in the cache so the source image is not needed'''
+        key = get_tile_key(name, size)
+        return key in self.memory or bool(self.path and os.path.isfile(self.get_file(key)))
+
+    def get(self, name, source, size):
+        '''returns the tile for the source image, decoded only if it is not in the cache.
+           raises a KeyError if the tile is not cached (anymore) and the source is None'''
+        key = get_tile_key(name, size)
+        with self.lock:
+            data = self.memory.pop(key, None)
+            if data is not None:
+                self.used -= len(data)
+                self.hits += 1
+        if data is None and self.path and os.path.isfile(self.get_file(key)):
+            try:
+                with open(self.get_file(key), "rb") as tile_file:
+                    data = tile_file.read()
+                self.disk_hits += 1
+            except (IOError, OSError):
+                # removed by a concurrent prune
+                data = None
+        if data is None or len(data) != size[0] * size[1] * 3:
+            if source is None:
+                raise KeyError(name)
+            data = decode_tile(source, size).tobytes()
+            self.decodes += 1
+            self.save(key, data)
+        with self.lock:
+            if key not in self.memory:
+                self.memory[key] = data
+                self.used += len(data)
+            while self.used > self.max_memory and self.memory:
+                self.used -= len(self.memory.popitem(last=False)[1])
+        return Image.frombytes("RGB", size, data)
+
+    def save(self, key, data):
+        '''store the tile on disk, written to a temporary file first as multiple processes share the folder'''
+        if not self.path:
+            return
+        tmp_file = "%s.%s.%s.tmp" % (self.get_file(key), os.getpid(), threading.current_thread().ident)
+        with open(tmp_file, "wb") as tile_file:
+            tile_file.write(data)
+        os.rename(tmp_file, self.get_file(key))
+
+    def get_stats(self):
+        '''returns the number of memory hits, disk hits and decoded tiles'''
+        return self.hits, self.disk_hits, self.decodes
+
+
+TILE_CACHE = TileCache()
+
+
+def init_worker():
+    '''initializer of the worker processes: the lock of the tile cache may have been held by another thread
+       of the parent process when the worker was forked'''
+    TILE_CACHE.lock = threading.Lock()
+
+
+def prune_tiles(path, max_size=TILE_DISK_LIMIT):
+    '''remove the least recently written tile files until the folder fits in max_size bytes'''
+    files = []
+    total_size = 0
+    for filename in os.listdir(path):
+        tile_file = os.path.join(path, filename)
+        stat = os.stat(tile_file)
+        files.append((stat.st_mtime, tile_file, stat.st_size))
+        total_size += stat.st_size
+    for _, tile_file, size in sorted(files):
+        if total_size <= max_size:
+            break
+        os.remove(tile_file)
+        total_size -= size
+
+
+def render_wall(tiles, layout, out_file, out_file_bw, tile_path=None, base_file=None, indexes=None):
+    '''compose a wall of the tiles (list of (name, source) tuples) and save the color and the black and white version,
+       with a base_file only the tiles at the given indexes are rendered on top of the existing (color) wall.
+       returns the indexes of the tiles which failed to decode, the time spent on each tile, the tile cache stats
+       and the indexes of the tiles without a source which were not in the tile cache (anymore)'''
+    columns, rows, width, height = layout
+    TILE_CACHE.path = tile_path
+    stats_before = TILE_CACHE.get_stats()
+    canvas = None
+    if base_file:
+        try:
+            canvas = Image.open(base_file).convert("RGB")
+        except Exception:
+            canvas = None
+    if not canvas or canvas.size != (width * columns, height * rows) or indexes is None:
+        # no (valid) existing wall, render all tiles
+        canvas = Image.new("RGB", (width * columns, height * rows))
+        indexes = range(min(len(tiles), columns * rows))
+    failed = []
+    missing = []
+    timings = []
+    for index in indexes:
+        name, source = tiles[index]
+        start = time.time()
+        try:
+            img = TILE_CACHE.get(name, source, (width, height))
+            canvas.paste(img, ((index % columns) * width, (index // columns) * height))
+            del img
+        except Exception:
+            (missing if source is None else failed).append(index)
+        timings.append(time.time() - start)
+    canvas.save(out_file, "JPEG")
+    canvas = canvas.convert("L")
+    canvas.save(out_file_bw, "JPEG")
+    cache_stats = tuple(after - before for after, before in zip(TILE_CACHE.get_stats(), stats_before))
+    return failed, timings, cache_stats, missing
+
+
+def render_wall_job(job):
+    '''entry point for the worker processes: job is a tuple with the arguments of render_wall'''
+    return render_wall(*job)
@@ -0,0 +1,94 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+    Small bounded pool of worker threads.
+    Used by the backgrounds service to fetch images from (slow) library and plugin sources in parallel.
+'''
+
+import threading
+import Queue
+import time
+from utils import log_exception
+
+
+class WorkerPool():
+    '''Bounded pool of daemon worker threads processing a shared job queue'''
+
+    def __init__(self, num_workers=4, name="SkinHelperBackgrounds.Worker"):
+        self.num_workers = max(1, num_workers)
+        self.name = name
+        self.exit = False
+        self.pending = 0
+        self.threads = []
+        self.jobs = Queue.Queue()
+        self.lock = threading.Condition()
+
+    def submit(self, func, *args, **kwargs):
+        '''queue a job for execution by one of the workers, returns False if the pool is stopped'''
+        with self.lock:
+            if self.exit:
+                return False
+            self.pending += 1
+            # spawn workers lazily, never more than the configured number
+            self.threads = [thread for thread in self.threads if thread.is_alive()]
+            if len(self.threads) < self.num_workers:
+                thread = threading.Thread(target=self.worker, name="%s.%s" % (self.name, len(self.threads)))
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+        self.jobs.put((func, args, kwargs))
+        return True
+
+    def join(self, timeout=None):
+        '''wait until all queued jobs are done or the timeout (in seconds) expired, returns True if all done'''
+        deadline = time.time() + timeout if timeout else None
+        with self.lock:
+            while self.pending and not self.exit:
+                if deadline:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self.lock.wait(remaining)
+                else:
+                    self.lock.wait(1)
+            return not self.pending
+
+    def resize(self, num_workers):
+        '''change the maximum number of workers, surplus workers exit once idle'''
+        with self.lock:
+            self.num_workers = max(1, num_workers)
+
+    def stop(self):
+        '''stop all workers, jobs which are not yet started are discarded'''
+        with self.lock:
+            self.exit = True
+            self.lock.notify_all()
+            threads = self.threads
+            self.threads = []
+        for thread in threads:
+            self.jobs.put(None)
+
+    def worker(self):
+        '''worker thread: process jobs from the queue until the pool is stopped'''
+        while not self.exit:
+            try:
+                job = self.jobs.get(timeout=30)
+            except Queue.Empty:
+                # exit idle worker if the pool was resized in the meantime
+                with self.lock:
+                    if len(self.threads) > self.num_workers and threading.current_thread() in self.threads:
+                        self.threads.remove(threading.current_thread())
+                        return
+                continue
+            if job is None or self.exit:
+                break
+            func, args, kwargs = job
+            try:
+                func(*args, **kwargs)
+            except Exception as exc:
+                log_exception(__name__, exc)
+            finally:
+                with self.lock:
+                    self.pending -= 1
+                    self.lock.notify_all()
@@ -7,13 +7,15 @@
 '''
 
 from resources.lib.backgrounds_updater import BackgroundsUpdater
+from resources.lib.kodimonitor import KodiMonitor
 from resources.lib.utils import log_msg
 import xbmc
 
-kodimonitor = xbmc.Monitor()
+kodimonitor = KodiMonitor()
 
 # run the background service
 backgrounds_updater = BackgroundsUpdater(kodimonitor=kodimonitor)
+kodimonitor.bgupdater = backgrounds_updater
 backgrounds_updater.start()
 
 # keep thread alive and send signal when we need to exit
@@ -22,5 +24,6 @@ while not kodimonitor.abortRequested():
 
 # stop requested
 log_msg("Abort requested !", xbmc.LOGNOTICE)
+kodimonitor.bgupdater = None
 backgrounds_updater.stop()
 log_msg("Stopped", xbmc.LOGNOTICE)
\ No newline at end of file